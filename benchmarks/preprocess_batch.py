@@ -0,0 +1,87 @@
+"""preprocess_batch.py
+
+Benchmark ocr.preprocess_batch against calling ocr.preprocess_img per image.
+
+The test images are resized to one shape and repeated to --count images,
+decoded up front so only preprocessing is timed. Both paths run with the
+same OpenCV thread count and their outputs are checked to be identical.
+
+    python benchmarks/preprocess_batch.py --count 64 --height 1000
+    python benchmarks/preprocess_batch.py --type median_blur --dilate --threads 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, PROJECT_ROOT)
+# Importing divvai creates the app, which needs a database URI.
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+from divvai import ocr  # noqa: E402
+
+TYPES = ('threshold', 'median_blur', 'bilateral_filter', 'mean_threshold', 'gauss_threshold')
+
+
+def load_images(count, height):
+    img_dir = os.path.join(PROJECT_ROOT, 'test_imgs')
+    images = []
+    for filename in sorted(os.listdir(img_dir)):
+        image = cv2.imread(os.path.join(img_dir, filename))
+        if image is not None:
+            images.append(cv2.resize(image, (height * 3 // 4, height), interpolation=cv2.INTER_AREA))
+    return [images[i % len(images)] for i in range(count)]
+
+
+def per_image(images, preprocess_type, dilate):
+    results = [ocr.preprocess_img(image, preprocess_type) for image in images]
+    if dilate:
+        results = [ocr.dilate_image(result) for result in results]
+    return results
+
+
+def best_of(runs, func, *args):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return result, min(times), statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--height', type=int, default=1200, help='image height in pixels')
+    parser.add_argument('--type', choices=TYPES, action='append',
+                        help='preprocess type, repeatable (default: all)')
+    parser.add_argument('--dilate', action='store_true', help='dilate text after preprocessing')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='OpenCV threads (default: os.cpu_count())')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    images = load_images(args.count, args.height)
+    megapixels = args.count * images[0].shape[0] * images[0].shape[1] / 1e6
+    print("%d images of %dx%d, %.0f MP, %d OpenCV threads" % (
+        args.count, images[0].shape[1], images[0].shape[0], megapixels,
+        args.threads or os.cpu_count()))
+    print("%-18s %12s %12s %8s" % ('type', 'loop img/s', 'batch img/s', 'speedup'))
+    for preprocess_type in args.type or TYPES:
+        with ocr.opencv_threads(args.threads):
+            expected, loop_s, _ = best_of(args.runs, per_image, images, preprocess_type, args.dilate)
+        results, batch_s, _ = best_of(args.runs, ocr.preprocess_batch, images, preprocess_type,
+                                      args.dilate, args.threads)
+        if not all(np.array_equal(a, b) for a, b in zip(expected, results)):
+            sys.exit("preprocess_batch output differs from preprocess_img for %s" % preprocess_type)
+        print("%-18s %12.1f %12.1f %7.2fx" % (
+            preprocess_type, args.count / loop_s, args.count / batch_s, loop_s / batch_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""startup.py
+
+Benchmark app startup: import time, create_app wall time, peak RSS and which
+heavy modules were loaded.
+
+Each run is a fresh interpreter so nothing is cached between runs.
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --web-only
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+HEAVY_MODULES = ('cv2', 'skimage', 'pytesseract', 'imutils', 'PIL', 'numpy', 'boto3', 'botocore')
+
+PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+from divvai.app import create_app
+t1 = time.perf_counter()
+create_app()
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_s': t1 - t0,
+    'create_app_s': t2 - t1,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'loaded': sorted(m for m in %r if m in sys.modules),
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once(env):
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=PROJECT_ROOT, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--web-only', action='store_true',
+                        help='run with WEB_ONLY=1 and fail if the CV stack is imported')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.web_only:
+        env['WEB_ONLY'] = '1'
+    results = [run_once(env) for _ in range(args.runs)]
+
+    # The import includes the module level app in divvai/__init__.py.
+    for key, label in (('import_s', 'import divvai.app'), ('create_app_s', 'create_app()')):
+        values = [r[key] * 1000 for r in results]
+        print("%-20s median %8.1f ms  min %8.1f ms" % (label, statistics.median(values), min(values)))
+    print("%-20s median %8.1f MB" % ('peak RSS', statistics.median(r['maxrss_kb'] for r in results) / 1024.0))
+    loaded = results[-1]['loaded']
+    print("%-20s %s" % ('heavy modules', ', '.join(loaded) or 'none'))
+
+    if args.web_only and set(loaded) & {'cv2', 'skimage', 'pytesseract', 'imutils'}:
+        sys.exit("CV stack imported in web-only mode: %s" % ', '.join(loaded))
+
+
+if __name__ == '__main__':
+    main()
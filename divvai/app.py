@@ -8,14 +8,14 @@ from flask_uploads import configure_uploads
 
 from divvai import receipts, vendors
 from divvai import views
-from divvai.extensions import bcrypt, db, migrate, bootstrap, images
+from divvai.extensions import bcrypt, db, migrate, bootstrap, cache, images
 from divvai.settings import configs
 
 
 def create_app(config=None):
     app = Flask(__name__.split('.')[0])
 
-    config = os.environ.get('CONFIG', 'dev')
+    config = config or os.environ.get('CONFIG', 'dev')
     app.logger.info("Config: %s" % config)
     app.config.from_object(configs.get(config, None) or configs['default'])
     app.template_folder = app.config.get('TEMPLATE_FOLDER', 'templates')
@@ -32,6 +32,7 @@ def register_extensions(app):
     db.init_app(app)
     migrate.init_app(app, db)
     bootstrap.init_app(app)
+    cache.init_app(app)
     configure_uploads(app, images)
 
 
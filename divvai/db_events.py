@@ -0,0 +1,46 @@
+"""db_events.py
+
+Apply changes collected during a transaction only once it commits.
+
+Mapper events fire at flush time, before it's known whether the transaction
+will commit. Listeners record their changes per session under a key in
+``session.info`` with pending(); after a commit the key's on_commit callback
+gets them, after a rollback they are dropped. In-memory indexes and caches
+thus never see uncommitted data.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_callbacks = {}
+
+
+def pending(session, key, factory=dict):
+    """
+    Return the changes collected under key in this session's transaction.
+    """
+    return session.info.setdefault(key, factory())
+
+
+def on_commit(key):
+    """
+    Register the decorated function to be called with the changes collected
+    under key, after each commit that collected any.
+    """
+    def register(func):
+        _callbacks[key] = func
+        return func
+    return register
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    for key, func in _callbacks.items():
+        changes = session.info.pop(key, None)
+        if changes:
+            func(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    for key in _callbacks:
+        session.info.pop(key, None)
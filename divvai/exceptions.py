@@ -9,3 +9,11 @@ class ImageFileNotFound(Exception):
 
 class S3FileNotFound(Exception):
     pass
+
+
+class CVStackDisabled(Exception):
+    pass
+
+
+class NoDocumentOutline(ValueError):
+    pass
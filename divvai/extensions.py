@@ -1,6 +1,6 @@
 """Extensions module. Each extension is initialized in the app factory located in app.py."""
 from flask_bcrypt import Bcrypt
-# from flask_caching import Cache
+from flask_caching import Cache
 # from flask_cors import CORS
 # from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
@@ -15,6 +15,7 @@ bcrypt = Bcrypt()
 db = SQLAlchemy()
 migrate = Migrate()
 bootstrap = Bootstrap()
+cache = Cache()
 
 images = UploadSet(DefaultConfig.IMAGE_SET_NAME, IMAGES)
 # from conduit.utils import jwt_identity, identity_loader  # noqa
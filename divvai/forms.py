@@ -1,16 +1,32 @@
+import os
+
 from flask_wtf import FlaskForm
-from wtforms import SelectField
+from wtforms import SelectField, ValidationError
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 
 from divvai.extensions import images
 
 
+def file_not_empty(form, field):
+    """
+    Reject empty uploads, which can't be mapped or decoded.
+    """
+    stream = field.data.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    if not size:
+        raise ValidationError('Empty file!')
+
+
 class UploadReceiptForm(FlaskForm):
     receipt_image = FileField(
         'Receipt Image',
         validators=[
             FileRequired(),
-            FileAllowed(images, 'Images only!')
+            FileAllowed(images, 'Images only!'),
+            file_not_empty,
         ]
     )
 
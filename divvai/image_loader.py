@@ -0,0 +1,139 @@
+"""image_loader.py
+
+Memory-mapped image loading shared by every stage of a processing run.
+
+OpenCV and NumPy are imported on first decode, so mapping a file (e.g. for
+the Rekognition bytes blob) doesn't load the CV stack.
+"""
+import mmap
+import os
+
+from divvai.exceptions import ImageFileNotFound
+
+# cv2.imread flags for decoding at full, 1/2, 1/4 or 1/8 of the stored
+# resolution. JPEGs are scaled during the DCT so reduced decodes are cheaper.
+REDUCED_FLAGS = {
+    'color': {
+        1: 'IMREAD_COLOR',
+        2: 'IMREAD_REDUCED_COLOR_2',
+        4: 'IMREAD_REDUCED_COLOR_4',
+        8: 'IMREAD_REDUCED_COLOR_8',
+    },
+    'gray': {
+        1: 'IMREAD_GRAYSCALE',
+        2: 'IMREAD_REDUCED_GRAYSCALE_2',
+        4: 'IMREAD_REDUCED_GRAYSCALE_4',
+        8: 'IMREAD_REDUCED_GRAYSCALE_8',
+    },
+}
+
+
+class MappedImage(object):
+    """
+    Read-only memory mapping of an image file.
+
+    The file is mapped once and decoded lazily with ``cv2.imdecode`` straight
+    from the mapped buffer. Every decode is cached per flag and handed out as a
+    non-writeable ndarray, so stages share the same pixels instead of
+    re-reading and re-decoding the file.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ImageFileNotFound("Local image file not found: %s" % path)
+        self.path = path
+        self._decoded = {}
+        if os.path.getsize(path) == 0:
+            raise ValueError("Empty image file: %s" % path)
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __repr__(self):
+        return '<MappedImage: {}>'.format(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._mmap)
+
+    @property
+    def closed(self):
+        return self._mmap.closed
+
+    def close(self):
+        """
+        Drop cached decodes and unmap the file.
+        """
+        self._decoded.clear()
+        if not self._mmap.closed:
+            self._mmap.close()
+
+    def buffer(self):
+        """
+        Return a zero-copy uint8 view over the mapped file.
+        """
+        import numpy as np
+        return np.frombuffer(self._mmap, dtype=np.uint8)
+
+    def tobytes(self):
+        """
+        Return the encoded file contents, e.g. for the Rekognition Bytes blob.
+        """
+        return self._mmap[:]
+
+    def decode(self, flags=None):
+        """
+        Return the image decoded with ``flags`` (default IMREAD_COLOR) as a
+        read-only ndarray.
+        """
+        import cv2
+        if flags is None:
+            flags = cv2.IMREAD_COLOR
+        image = self._decoded.get(flags)
+        if image is None:
+            image = cv2.imdecode(self.buffer(), flags)
+            if image is None:
+                raise ValueError("Unable to decode image: %s" % self.path)
+            image.flags.writeable = False
+            self._decoded[flags] = image
+        return image
+
+    def reduced(self, factor=2, gray=False):
+        """
+        Return a reduced-resolution decode for previews and contour detection.
+
+        :param factor: downscale factor, one of 1, 2, 4 or 8
+        :param gray: decode straight to grayscale
+        """
+        import cv2
+        try:
+            flags = REDUCED_FLAGS['gray' if gray else 'color'][factor]
+        except KeyError:
+            raise ValueError("Reduced decode factor (%s) must be 1, 2, 4 or 8." % factor)
+        return self.decode(getattr(cv2, flags))
+
+    def preview(self, min_height=500, gray=False):
+        """
+        Return the smallest reduced decode that is at least ``min_height`` tall.
+        """
+        import cv2
+        full = self._decoded.get(cv2.IMREAD_COLOR)
+        for factor in (8, 4, 2):
+            # Skip decodes we already know are too small.
+            if full is not None and full.shape[0] // factor < min_height:
+                continue
+            image = self.reduced(factor, gray=gray)
+            if image.shape[0] >= min_height:
+                return image
+        return self.reduced(1, gray=gray)
+
+
+def load_image(path):
+    """
+    Return a MappedImage for ``path``.
+    """
+    return MappedImage(path)
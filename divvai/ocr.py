@@ -2,11 +2,17 @@
 
 Functinos relating to image recognition.
 """
+import hashlib
+import inspect
 import os
+import subprocess
 import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
 
 import cv2
-import boto3
 import imutils
 import pytesseract
 import numpy as np
@@ -15,13 +21,21 @@ from PIL import Image
 from skimage.filters import threshold_local
 from flask import current_app
 
+from divvai import pipeline
+from divvai.exceptions import NoDocumentOutline
+from divvai.image_loader import MappedImage
+from divvai.pipeline import PARAMS_BY_METHOD, PREPROCESS_PARAMS, pipeline_fingerprint  # noqa: F401
+from divvai.rekognition import RekognitionDispatcher, rekognition_image
+
 
 def return_img(image):
     """
-    Return image from string / img.
+    Return image from string / MappedImage / img.
     """
     if isinstance(image, str):
         image = cv2.imread(image)
+    elif isinstance(image, MappedImage):
+        image = image.decode()
     return image
 
 
@@ -29,46 +43,183 @@ def get_text_from_img_aws(key=None, img_bytes=None):
     """
     Return text from image using amazon rekognition.
 
+    Calls go through the app's RekognitionDispatcher, so they are rate
+    limited and retried when throttled.
+
     :param key: s3 key of image without bucket
     :type key: string
     :param img_bytes: Blob of img to use rekognition
     :type img_bytes: bytes
     """
-    rekognition = boto3.client("rekognition")
-    if key:
-        bucket = current_app.config['UPLOAD_BUCKET']
-        response = rekognition.detect_text(
-            Image={
-                'S3Object': {
-                    'Bucket': bucket,
-                    'Name': key
-                }
-            })
-    elif img_bytes:
-        response = rekognition.detect_text(Image={'Bytes': img_bytes})
-    else:
-        e = "One of these parameters must be set: (key, img_bytes)"
-        raise ValueError(e)
-    return response
+    return RekognitionDispatcher.from_app().detect_text(rekognition_image(key, img_bytes))
 
 
-def get_text_from_img(img_path, dilate_text=True):
+def get_text_from_img(image, dilate_text=True):
     # Load image and remove color and preprocess
-    image = cv2.imread(img_path)
+    image = return_img(image)
     if dilate_text:
         image = dilate_image(image)
-    # Write to local file for pytesseract to read
-    filename = "{}.png".format(os.getpid())
-    cv2.imwrite(filename, image)
-    text = pytesseract.image_to_string(Image.open(filename))
-    os.remove(filename)
-    return text
+    return image_to_string(image)
+
+
+def image_to_string(image, omp_thread_limit=None):
+    """
+    Return tesseract text for an ndarray.
+
+    With omp_thread_limit, OMP_THREAD_LIMIT is set for this tesseract call
+    only. pytesseract can't pass an environment, so tesseract is then run
+    directly with the image on stdin.
+    """
+    if omp_thread_limit is None:
+        return pytesseract.image_to_string(Image.fromarray(image))
+    env = dict(os.environ, OMP_THREAD_LIMIT=str(omp_thread_limit))
+    png = cv2.imencode('.png', image)[1].tobytes()
+    try:
+        proc = subprocess.run([pytesseract.pytesseract.tesseract_cmd, 'stdin', 'stdout'],
+                              input=png, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    except FileNotFoundError:
+        raise pytesseract.TesseractNotFoundError()
+    if proc.returncode:
+        raise pytesseract.TesseractError(proc.returncode,
+                                         proc.stderr.decode('utf-8', 'replace').strip())
+    return proc.stdout.decode('utf-8')
+
+
+def get_text_from_img_tiled(image, strip_height=1200, overlap=60, workers=None,
+                            dilate_text=True):
+    """
+    Return text from a tall image by running tesseract on strips in parallel.
+
+    The image is cut into overlapping horizontal strips at blank rows, each
+    strip is OCR'd in its own tesseract process and the text is stitched back
+    together in order with the lines repeated in the overlaps removed.
+
+    :param strip_height: target height of each strip in pixels
+    :param overlap: rows shared between neighbouring strips
+    :param workers: concurrent tesseract processes, defaults to cpu count
+    """
+    image = return_img(image)
+    if dilate_text:
+        image = dilate_image(image)
+    ranges = split_strips(image, strip_height, overlap)
+    strips = [image[start:stop] for start, stop in ranges]
+    if len(strips) == 1:
+        return image_to_string(strips[0])
+    # One tesseract per core, each limited to one OpenMP thread so they
+    # don't oversubscribe the cores. Single page OCR keeps its threads.
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        texts = list(pool.map(partial(image_to_string, omp_thread_limit=1), strips))
+    return stitch_strip_text(texts, overlap_line_counts(image, ranges))
+
+
+def ink_profile(image, margin=0.05, smooth=5):
+    """
+    Return the dark pixel count per row (the horizontal projection profile),
+    smoothed over ``smooth`` rows.
+
+    ``margin`` of the width is ignored on each side, where the receipt's
+    edges and background noise would otherwise fill every row.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    skip = int(gray.shape[1] * margin)
+    ink = np.count_nonzero(gray[:, skip:gray.shape[1] - skip] < 128, axis=1)
+    return np.convolve(ink, np.ones(smooth) / smooth, mode='same')
+
+
+def find_blank_rows(image, gap_fraction=0.3, profile=None):
+    """
+    Return sorted indices of the rows between text lines.
+
+    Preprocessed photos are noisy and slightly skewed, so rows between lines
+    are rarely free of ink. A row counts as blank when it has at most
+    ``gap_fraction`` of the median ink of the inked rows.
+    """
+    if profile is None:
+        profile = ink_profile(image)
+    inked = profile[profile >= 1]
+    limit = gap_fraction * np.median(inked) if inked.size else 0
+    return np.flatnonzero(profile <= max(1, limit))
+
+
+def _lowest_row(profile, lo, hi):
+    """
+    Return the last row in [lo, hi) with the least ink.
+    """
+    window = profile[lo:hi][::-1]
+    return hi - 1 - int(np.argmin(window))
+
+
+def split_strips(image, strip_height=1200, overlap=60):
+    """
+    Return (start, stop) row ranges of overlapping strips covering image.
+
+    Strips end on the row with the least ink in the back half of each strip
+    and start on the row with the least ink between ``2 * overlap`` and
+    ``overlap`` rows before the previous cut, so cuts fall between text
+    lines rather than through them.
+    """
+    height = image.shape[0]
+    if height <= strip_height:
+        return [(0, height)]
+    profile = ink_profile(image)
+    cuts = [0]
+    while height - cuts[-1] > strip_height:
+        cuts.append(_lowest_row(profile, cuts[-1] + strip_height // 2,
+                                cuts[-1] + strip_height + 1))
+    cuts.append(height)
+
+    strips = []
+    for start, stop in zip(cuts[:-1], cuts[1:]):
+        if start > 0:
+            start = _lowest_row(profile, max(0, start - 2 * overlap), max(1, start - overlap + 1))
+        strips.append((start, stop))
+    return strips
+
+
+def overlap_line_counts(image, ranges):
+    """
+    Return, for each strip range, how many text lines it shares with the
+    previous strip: the runs of inked rows in their overlap.
+    """
+    ink = np.ones(image.shape[0], dtype=bool)
+    ink[find_blank_rows(image)] = False
+    counts = [0]
+    for (_, prev_stop), (start, _) in zip(ranges[:-1], ranges[1:]):
+        rows = ink[start:prev_stop]
+        counts.append(int(rows[:1].sum() + np.count_nonzero(rows[1:] & ~rows[:-1])))
+    return counts
+
+
+def _normalize_line(line):
+    return ' '.join(line.lower().split())
+
+
+def stitch_strip_text(texts, overlap_lines):
+    """
+    Return the strip texts joined in order with overlapping lines removed.
+
+    :param overlap_lines: per strip, the number of text lines it shares with
+        the previous one, see overlap_line_counts. Those lines are dropped
+        from the head of the strip only if they read exactly like the tail
+        of the text so far; if OCR read them differently both are kept, as
+        a repeated line is better than a lost one.
+    """
+    lines = []
+    for text, k in zip(texts, overlap_lines):
+        new_lines = [line for line in text.splitlines() if line.strip()]
+        k = min(k, len(lines), len(new_lines))
+        tail = [_normalize_line(line) for line in lines[len(lines) - k:]]
+        if k and tail == [_normalize_line(line) for line in new_lines[:k]]:
+            new_lines = new_lines[k:]
+        lines.extend(new_lines)
+    return '\n'.join(lines)
 
 
 def dilate_image(image):
     image = return_img(image)
     inv = cv2.bitwise_not(image)
-    kernel = np.ones((5, 5), np.uint8)
+    size = PREPROCESS_PARAMS['dilate_kernel']
+    kernel = np.ones((size, size), np.uint8)
     dilation = cv2.dilate(inv, kernel, iterations=1)
     inv_again = cv2.bitwise_not(dilation)
     return inv_again
@@ -86,21 +237,280 @@ def preprocess_img(image, preprocess_type, make_gray=True):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     else:
         gray = image
+    params = PREPROCESS_PARAMS
     if preprocess_type == 'median_blur':
-        return cv2.medianBlur(gray, 3)
+        return cv2.medianBlur(gray, params['median_blur_ksize'])
     elif preprocess_type == 'bilateral_filter':
-        return cv2.bilateralFilter(gray, 9, 10, 200)
+        return cv2.bilateralFilter(gray, *params['bilateral_filter'])
     elif preprocess_type == 'threshold':
         return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
     elif preprocess_type == 'mean_threshold':
-        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                     cv2.THRESH_BINARY, 11, 2)
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                     params['adaptive_block_size'], params['adaptive_c'])
     elif preprocess_type == 'gauss_threshold':
-        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                     cv2.THRESH_BINARY, 11, 2)
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                     params['adaptive_block_size'], params['adaptive_c'])
     raise ValueError("Preprocess Method (%s) not recognized.")
 
 
+@contextmanager
+def opencv_threads(threads=None):
+    """
+    Run the block with OpenCV's thread pool set to ``threads`` (default
+    os.cpu_count()), restoring the previous setting afterwards.
+
+    The setting is process wide, so don't nest this in concurrent threads.
+    """
+    previous = cv2.getNumThreads()
+    cv2.setNumThreads(threads or os.cpu_count() or 1)
+    try:
+        yield
+    finally:
+        cv2.setNumThreads(previous)
+
+
+# Border fill of each preprocess method's filter, as numpy pad modes.
+BATCH_BORDERS = {
+    'median_blur': 'edge',
+    'bilateral_filter': 'reflect',
+    'mean_threshold': 'edge',
+    'gauss_threshold': 'edge',
+    'threshold': None,
+}
+
+
+def _filter_radius(preprocess_type):
+    params = PREPROCESS_PARAMS
+    if preprocess_type == 'median_blur':
+        return params['median_blur_ksize'] // 2
+    elif preprocess_type == 'bilateral_filter':
+        return params['bilateral_filter'][0] // 2
+    elif preprocess_type in ('mean_threshold', 'gauss_threshold'):
+        return params['adaptive_block_size'] // 2
+    return 0
+
+
+def _fill_borders(slab, pad, mode):
+    """
+    Fill the ``pad`` spare rows above and below each image of an
+    (n, pad + h + pad, w) slab the way OpenCV fills a filter's border.
+    """
+    h = slab.shape[1] - 2 * pad
+    if mode == 'constant':
+        slab[:, :pad] = 0
+        slab[:, pad + h:] = 0
+        return
+    for j in range(1, pad + 1):
+        if mode == 'edge':
+            top, bottom = pad, pad + h - 1
+        else:  # 'reflect', OpenCV's BORDER_REFLECT_101
+            top, bottom = pad + j, pad + h - 1 - j
+        slab[:, pad - j] = slab[:, top]
+        slab[:, pad + h - 1 + j] = slab[:, bottom]
+
+
+def _preprocess_group(images, preprocess_type, make_gray=True, dilate=False):
+    """
+    Preprocess same sized images as one tall image, see preprocess_batch.
+
+    Images are written into a single (n, pad + h + pad, w) slab with spare
+    rows filled like OpenCV's own border, so a filter over the whole slab
+    gives each image the same pixels as filtering it on its own.
+    """
+    h, w = images[0].shape[:2]
+    n = len(images)
+    radius = _filter_radius(preprocess_type)
+    dilate_radius = PREPROCESS_PARAMS['dilate_kernel'] // 2 if dilate else 0
+    pad = max(radius, dilate_radius)
+    slab = np.empty((n, h + 2 * pad, w), np.uint8)
+    for image, rows in zip(images, slab):
+        if make_gray:
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=rows[pad:pad + h])
+        else:
+            rows[pad:pad + h] = image
+    tall = slab.reshape(-1, w)
+    mode = BATCH_BORDERS[preprocess_type]
+    if mode:
+        _fill_borders(slab, pad, mode)
+
+    params = PREPROCESS_PARAMS
+    if preprocess_type == 'median_blur':
+        tall = cv2.medianBlur(tall, params['median_blur_ksize'])
+    elif preprocess_type == 'bilateral_filter':
+        tall = cv2.bilateralFilter(tall, *params['bilateral_filter'])
+    elif preprocess_type == 'threshold':
+        # Otsu's threshold is global to each image, nothing to share.
+        for rows in slab:
+            image = rows[pad:pad + h]
+            cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=image)
+    elif preprocess_type == 'mean_threshold':
+        tall = cv2.adaptiveThreshold(tall, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                     params['adaptive_block_size'], params['adaptive_c'])
+    elif preprocess_type == 'gauss_threshold':
+        tall = cv2.adaptiveThreshold(tall, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                     params['adaptive_block_size'], params['adaptive_c'])
+
+    if dilate:
+        # dilate_image: dilate the inverted image and invert it back. Zero
+        # rows leave a dilation unchanged, like OpenCV's default border.
+        size = params['dilate_kernel']
+        cv2.bitwise_not(tall, dst=tall)
+        slab = tall.reshape(n, h + 2 * pad, w)
+        _fill_borders(slab, pad, 'constant')
+        tall = cv2.dilate(tall, np.ones((size, size), np.uint8), iterations=1)
+        cv2.bitwise_not(tall, dst=tall)
+    return list(tall.reshape(n, h + 2 * pad, w)[:, pad:pad + h])
+
+
+def preprocess_batch(images, preprocess_type, dilate=False, threads=None, max_pixels=2 ** 22):
+    """
+    Return preprocess_img(image, preprocess_type) for every image, in order,
+    with dilate_image applied too if ``dilate`` is set.
+
+    Images are grouped by shape and each group goes through every step as
+    one OpenCV call, which OpenCV splits across ``threads``. Results match
+    preprocess_img pixel for pixel.
+
+    :param images: paths, MappedImages or ndarrays
+    :param max_pixels: most pixels processed as one group. Groups that fit in
+        cache run faster than one huge slab, so full size photos (~12MP)
+        are processed one at a time and only smaller images are stacked.
+    """
+    if preprocess_type not in PARAMS_BY_METHOD:
+        raise ValueError("Preprocess Method (%s) not recognized." % preprocess_type)
+    make_gray = True
+    if preprocess_type == 'edge_detection':
+        # The warp is per image; the mean threshold after it is batched.
+        images = [get_largest_rectangle(return_img(image)) for image in images]
+        preprocess_type, make_gray = 'mean_threshold', False
+    else:
+        images = [return_img(image) for image in images]
+
+    groups = defaultdict(list)
+    for i, image in enumerate(images):
+        groups[image.shape].append(i)
+    results = [None] * len(images)
+    with opencv_threads(threads):
+        for shape, indices in groups.items():
+            if shape[0] <= 2 * PREPROCESS_PARAMS['bilateral_filter'][0]:
+                # Reflected borders need more rows than the padding.
+                for i in indices:
+                    results[i] = preprocess_img(images[i], preprocess_type, make_gray)
+                    if dilate:
+                        results[i] = dilate_image(results[i])
+                continue
+            per_group = max(1, max_pixels // (shape[0] * shape[1]))
+            for start in range(0, len(indices), per_group):
+                chunk = indices[start:start + per_group]
+                out = _preprocess_group([images[i] for i in chunk], preprocess_type,
+                                        make_gray, dilate)
+                for i, image in zip(chunk, out):
+                    results[i] = image
+    return results
+
+
+@lru_cache(maxsize=None)
+def tesseract_version():
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except (OSError, pytesseract.TesseractNotFoundError):
+        return 'unknown'
+
+
+@lru_cache(maxsize=None)
+def pipeline_code_hash():
+    """
+    Return a hash of the source of every function in the preprocess/OCR
+    pipeline, so code changes mark processed receipts as stale.
+    """
+    functions = (return_img, preprocess_img, get_largest_rectangle, load_and_resize_img,
+                 get_edges, find_outline, find_contours, four_point_transform, order_points,
+                 dilate_image, get_text_from_img, get_text_from_img_tiled, image_to_string,
+                 ink_profile, find_blank_rows, _lowest_row, split_strips, overlap_line_counts,
+                 stitch_strip_text)
+    source = ''.join(inspect.getsource(f) for f in functions)
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def pipeline_info(preprocess_type, engine='tesseract', tile_options=None):
+    """
+    Return pipeline.pipeline_info with this tesseract's version and code hash.
+    """
+    if engine == 'rekognition':
+        return pipeline.pipeline_info(preprocess_type, engine, tile_options)
+    return pipeline.pipeline_info(preprocess_type, engine, tile_options,
+                                  engine_version=tesseract_version(), code=pipeline_code_hash())
+
+
+def quality_scores(image, height=500):
+    """
+    Return cheap image quality scores used to decide whether to OCR an image.
+
+    Scores are computed on a grayscale copy about ``height`` pixels tall; for
+    a MappedImage that is a reduced decode, so the full image is never decoded.
+
+    - blur: variance of the Laplacian, low for blurry images
+    - brightness: mean intensity in [0, 1]
+    - clipped: fraction of pixels that are nearly black or nearly white
+    - text_density: fraction of pixels on edges, near 0 without any text
+    - document_area: area of the document outline (see find_outline) / image
+      area, 0 if there's no outline of at least min_outline_area
+    - document_aspect: long side / short side of the outline's min area rect
+    """
+    if isinstance(image, MappedImage):
+        gray = image.preview(min_height=height, gray=True)
+    else:
+        gray = return_img(image)
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+    if gray.shape[0] > height:
+        width = max(1, int(gray.shape[1] * height / float(gray.shape[0])))
+        gray = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+    hist = np.bincount(gray.ravel(), minlength=256) / float(gray.size)
+    edged = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), *PREPROCESS_PARAMS['canny_thresholds'])
+    # The outline edge detection would use, so the gate predicts it.
+    outline = find_outline(edged, PREPROCESS_PARAMS['min_outline_area'])
+    document_area, document_aspect = 0.0, 0.0
+    if outline is not None:
+        document_area = cv2.contourArea(outline) / float(gray.size)
+        sides = sorted(cv2.minAreaRect(outline)[1])
+        document_aspect = sides[1] / sides[0] if sides[0] else 0.0
+    return {
+        'blur': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        'brightness': float(np.dot(hist, np.arange(256))) / 255.0,
+        'clipped': float(hist[:16].sum() + hist[240:].sum()),
+        'text_density': float(np.count_nonzero(edged)) / edged.size,
+        'document_area': document_area,
+        'document_aspect': document_aspect,
+    }
+
+
+def quality_issues(scores, thresholds):
+    """
+    Return a list of problems ('blurry', 'too dark', ...) found in scores.
+
+    :param thresholds: dict with min_blur, min_brightness, max_brightness,
+        max_clipped, min_text_density, min_document_area and
+        min_document_aspect, see settings.QUALITY_THRESHOLDS
+    """
+    issues = []
+    if scores['blur'] < thresholds['min_blur']:
+        issues.append('blurry')
+    if scores['brightness'] < thresholds['min_brightness']:
+        issues.append('too dark')
+    if scores['brightness'] > thresholds['max_brightness']:
+        issues.append('overexposed')
+    if scores['clipped'] > thresholds['max_clipped']:
+        issues.append('clipped exposure')
+    if scores['text_density'] < thresholds['min_text_density']:
+        issues.append('no text')
+    if (scores['document_area'] < thresholds['min_document_area']
+            or scores['document_aspect'] < thresholds['min_document_aspect']):
+        issues.append('no document')
+    return issues
+
+
 def set_image_dpi(file_path):
     """
     Return opencv2 image from file_path with a DPI of 300. Optimized for pytesseract.
@@ -117,12 +527,19 @@ def set_image_dpi(file_path):
 
 
 def get_largest_rectangle(image):
+    """
+    Return the thresholded birds eye view of the largest rectangle in image.
+
+    Contours are found on a resize of the full decode. A reduced (DCT scaled)
+    decode gives different edges and misses outlines the resize finds.
+    """
     ratio, resized_img = load_and_resize_img(image)
     edged = get_edges(resized_img)
     contoured_img, screenCnt = find_contours(edged, resized_img)
     warped = four_point_transform(image, screenCnt.reshape(4, 2) * ratio)
     warped = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
-    T = threshold_local(warped, 11, offset=10, method="gaussian")
+    T = threshold_local(warped, PREPROCESS_PARAMS['threshold_local_block_size'],
+                        offset=PREPROCESS_PARAMS['threshold_local_offset'], method="gaussian")
     warped = (warped > T).astype("uint8") * 255
     return warped
 
@@ -132,37 +549,46 @@ def load_and_resize_img(image):
     Load image, compute ratio of old height to new heigh, clone and resize.
     """
     # Speeds up processing and its more accurate
-    ratio = image.shape[0] / 500.0
-    resized_img = imutils.resize(image.copy(), height=500)
+    height = PREPROCESS_PARAMS['contour_height']
+    ratio = image.shape[0] / float(height)
+    resized_img = imutils.resize(image.copy(), height=height)
     return ratio, resized_img
 
 
 def get_edges(image):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     gray = cv2.GaussianBlur(gray, (5, 5), 0)
-    edged = cv2.Canny(gray, 75, 200)
+    edged = cv2.Canny(gray, *PREPROCESS_PARAMS['canny_thresholds'])
     return edged
 
 
-def find_contours(edged, image):
+def find_outline(edged, min_area=0.0):
+    """
+    Return the four corners of the document outline in an edge map, the
+    largest four-sided contour covering at least ``min_area`` of the image,
+    or None if there isn't one.
+    """
     cnts = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
     cnts = imutils.grab_contours(cnts)
     cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:5]
     # loop over the contours
-    screenCnt = None
     for c in cnts:
         # approximate the contour
         peri = cv2.arcLength(c, True)
         approx = cv2.approxPolyDP(c, 0.02 * peri, True)
         # if our approximated contour has four points, then we
         # can assume that we have found our screen
-        if len(approx) == 4:
-            screenCnt = approx
-            break
+        if len(approx) == 4 and cv2.contourArea(approx) >= min_area * edged.size:
+            return approx
+    return None
+
+
+def find_contours(edged, image):
+    screenCnt = find_outline(edged, PREPROCESS_PARAMS['min_outline_area'])
     if screenCnt is not None:
         cv2.drawContours(image, [screenCnt], -1, (0, 255, 0), 2)
     else:
-        raise ValueError("No appropriate contours found for image.")
+        raise NoDocumentOutline("No appropriate contours found for image.")
     return image, screenCnt
 
 
@@ -0,0 +1,69 @@
+"""pipeline.py
+
+Describe and fingerprint the preprocess/OCR pipeline.
+
+Nothing here imports the CV stack, so Rekognition results can be recorded on
+nodes without it. divvai.ocr fills in the tesseract version and code hash.
+"""
+import hashlib
+import json
+
+# Preprocessing parameters. They are part of the pipeline fingerprint, so
+# changing one marks receipts processed with it as stale.
+PREPROCESS_PARAMS = {
+    'contour_height': 500,
+    'min_outline_area': 0.1,  # of the image, smaller four-sided contours aren't the receipt
+    'canny_thresholds': (75, 200),
+    'threshold_local_block_size': 11,
+    'threshold_local_offset': 10,
+    'adaptive_block_size': 11,
+    'adaptive_c': 2,
+    'median_blur_ksize': 3,
+    'bilateral_filter': (9, 10, 200),
+    'dilate_kernel': 5,
+}
+
+# PREPROCESS_PARAMS used by each preprocess method.
+PARAMS_BY_METHOD = {
+    'edge_detection': ('contour_height', 'min_outline_area', 'canny_thresholds',
+                       'threshold_local_block_size', 'threshold_local_offset',
+                       'adaptive_block_size', 'adaptive_c'),
+    'threshold': (),
+    'median_blur': ('median_blur_ksize',),
+    'bilateral_filter': ('bilateral_filter',),
+    'mean_threshold': ('adaptive_block_size', 'adaptive_c'),
+    'gauss_threshold': ('adaptive_block_size', 'adaptive_c'),
+}
+
+
+def pipeline_info(preprocess_type, engine='tesseract', tile_options=None,
+                  engine_version=None, code=None):
+    """
+    Return a dict describing everything that determines a receipt's OCR output.
+
+    :param preprocess_type: preprocess method, None if the image wasn't preprocessed
+    :param engine: 'tesseract' or 'rekognition'
+    :param tile_options: tiled OCR settings, e.g. {'strip_height': 1200,
+        'overlap': 60}, or None for single page tesseract
+    :param engine_version: tesseract version, see ocr.tesseract_version
+    :param code: hash of the pipeline source, see ocr.pipeline_code_hash
+    """
+    if engine == 'rekognition':
+        return {'engine': engine}
+    params = dict((key, PREPROCESS_PARAMS[key])
+                  for key in PARAMS_BY_METHOD.get(preprocess_type, ()) + ('dilate_kernel',))
+    return {
+        'engine': engine,
+        'engine_version': engine_version,
+        'preprocess_type': preprocess_type,
+        'params': params,
+        'tiles': tile_options,
+        'code': code,
+    }
+
+
+def pipeline_fingerprint(info):
+    """
+    Return a stable hash of pipeline_info output.
+    """
+    return hashlib.sha1(json.dumps(info, sort_keys=True).encode('utf-8')).hexdigest()
@@ -1,4 +1,6 @@
+import json
 import re
+from decimal import Decimal
 
 phone_regex = re.compile(
     r"([0-9]( |-)?)?(\(?[0-9]{3}\)?|[0-9]{3})( |-)?([0-9]{3}( |-)?[0-9]{4}|[0-9]{7})"
@@ -29,3 +31,152 @@ def get_email(s):
 
 def get_phone(s):
     return get_matches(s, phone_regex)
+
+
+def get_phones(s):
+    """
+    Return every phone number-like match in s, in order.
+    """
+    return [match.group(0) for match in phone_regex.finditer(s)]
+
+
+def normalize_phone(s):
+    """
+    Return the 10 digit US phone number in s, e.g. '1 (202) 555-0100' -> '2025550100'.
+    """
+    if not s:
+        return None
+    digits = re.sub(r"\D", "", s)
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    if len(digits) == 10:
+        return digits
+
+
+def normalize_name(s):
+    """
+    Return s lowercased with punctuation dropped and whitespace collapsed.
+    """
+    return ' '.join(re.sub(r"[^\w\s]", " ", s.lower()).split())
+
+
+def trigrams(s):
+    """
+    Return the set of character trigrams of the normalized, padded string.
+    """
+    s = '  %s ' % normalize_name(s)
+    return set(s[i:i + 3] for i in range(len(s) - 2))
+
+
+date_regex = re.compile(
+    r"\b(\d{1,2}[/-]\d{1,2}[/-](\d{4}|\d{2})|\d{4}-\d{2}-\d{2})\b"
+)
+
+line_item_regex = re.compile(
+    r"^(?P<description>.*?\S)\s+\$?(?P<price>-?\d{1,6}[.,]\d{2})(?P<credit>-)?"
+    r"(\s+[A-Z*]{1,2})?\s*$"
+)
+
+# Keywords for non-item lines, checked in order against the description.
+summary_regexes = tuple(
+    (kind, re.compile(r"\b(%s)\b" % '|'.join(keywords), re.IGNORECASE))
+    for kind, keywords in (
+        ('subtotal', ('subtotal', 'sub total', 'sub-total')),
+        ('tax', ('tax', 'sales tax')),
+        ('tip', ('tip', 'gratuity')),
+        ('total', ('total', 'balance due', 'amount due')),
+        ('payment', ('cash', 'change', 'visa', 'mastercard', 'amex', 'discover',
+                     'debit', 'credit', 'tend', 'tender')),
+    )
+)
+
+
+def get_date(s):
+    return get_matches(s, date_regex)
+
+
+def parse_price(s):
+    """
+    Return Decimal from a price string, e.g. '$1,99' -> Decimal('1.99').
+    """
+    return Decimal(s.replace('$', '').replace(',', '.').strip())
+
+
+def classify_line(description):
+    """
+    Return the summary kind ('subtotal', 'tax', ...) of a line or 'item'.
+    """
+    for kind, regex in summary_regexes:
+        if regex.search(description):
+            return kind
+    return 'item'
+
+
+def parse_receipt_text(text):
+    """
+    Return (items, totals) parsed from receipt text.
+
+    items is a list of (description, Decimal price) in receipt order and totals
+    maps 'subtotal', 'tax', 'tip' and 'total' to the last price found for them.
+    """
+    items = []
+    totals = {}
+    for line in text.splitlines():
+        match = line_item_regex.match(line.strip())
+        if not match:
+            continue
+        description = match.group('description').strip()
+        price = parse_price(match.group('price'))
+        if match.group('credit'):
+            # Trailing minus is the usual print format for discounts/coupons.
+            price = -price
+        kind = classify_line(description)
+        if kind == 'item':
+            items.append((description, price))
+        elif kind != 'payment':
+            totals[kind] = price
+    return items, totals
+
+
+def rekognition_lines(response, row_tolerance=0.5):
+    """
+    Return text lines, top to bottom, from a Rekognition detect_text response.
+
+    LINE detections whose vertical centers are within ``row_tolerance`` line
+    heights of each other are merged into one row and joined left to right,
+    so a description and its price printed far apart end up on one line.
+    """
+    if isinstance(response, str):
+        response = json.loads(response)
+    detections = []
+    for detection in response.get('TextDetections', []):
+        if detection.get('Type') != 'LINE':
+            continue
+        box = detection['Geometry']['BoundingBox']
+        center = box['Top'] + box['Height'] / 2.0
+        detections.append((center, box['Left'], box['Height'], detection['DetectedText']))
+    detections.sort()
+
+    rows = []
+    for center, left, height, text in detections:
+        if rows and abs(center - rows[-1]['center']) <= row_tolerance * height:
+            rows[-1]['words'].append((left, text))
+        else:
+            rows.append({'center': center, 'words': [(left, text)]})
+    return [' '.join(text for _, text in sorted(row['words'])) for row in rows]
+
+
+def receipt_text(raw_text):
+    """
+    Return plain text from raw_text, which is either tesseract output or a
+    JSON dump of a Rekognition response.
+    """
+    if not raw_text:
+        return ''
+    try:
+        response = json.loads(raw_text)
+    except ValueError:
+        return raw_text
+    if isinstance(response, dict) and 'TextDetections' in response:
+        return '\n'.join(rekognition_lines(response))
+    return raw_text
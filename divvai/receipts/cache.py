@@ -0,0 +1,62 @@
+"""cache.py
+
+Server-side cache of rendered receipt detail pages.
+
+Each entry holds the rendered receipt body, the receipt's ETag and the
+fields the page and image endpoints need, so a client revalidating a receipt
+is answered with a single primary key lookup of its version, without loading
+or rendering the receipt or touching the disk or S3. Entries are dropped once
+a transaction changing the receipt (or its line items) commits; an entry
+that still went stale, e.g. one set by a request that read the receipt just
+before such a commit, or one in another process's SimpleCache, is caught by
+its version and re-rendered.
+"""
+from flask import render_template
+
+from divvai.database import db
+from divvai.db_events import on_commit
+from divvai.extensions import cache
+from divvai.receipts.models import Receipt
+
+
+def detail_cache_key(receipt_id):
+    return 'receipt_detail/%s' % receipt_id
+
+
+def receipt_detail_entry(receipt_id):
+    """
+    Return the cached detail entry for a receipt, rendering it on a miss.
+    Returns None if the receipt doesn't exist.
+    """
+    key = detail_cache_key(receipt_id)
+    entry = cache.get(key)
+    if entry is not None:
+        version = db.session.query(Receipt.version).filter_by(id=receipt_id).scalar()
+        if version == entry['version']:
+            return entry
+    receipt = Receipt.query.get(receipt_id)
+    if receipt is None:
+        return None
+    entry = {
+        'id': receipt.id,
+        'version': receipt.version,
+        'etag': receipt.etag,
+        'img_filename': receipt.img_filename,
+        'img_hash': receipt.img_hash,
+        'preprocessed_img_filename': receipt.preprocessed_img_filename,
+        'body': render_template('receipts/_receipt_body.html', receipt=receipt),
+    }
+    cache.set(key, entry)
+    return entry
+
+
+def invalidate_receipts(receipt_ids):
+    cache.delete_many(*[detail_cache_key(receipt_id) for receipt_id in receipt_ids])
+
+
+@on_commit('receipts_changed')
+def _invalidate_committed(changed):
+    """
+    Drop cached pages of receipts changed in the committed transaction.
+    """
+    invalidate_receipts(changed)
@@ -1,24 +1,41 @@
 import os
 import uuid
 import json
-import cv2
 import tempfile
+from contextlib import contextmanager, nullcontext
+from itertools import chain
 
 from werkzeug.datastructures import FileStorage
 
-from flask import current_app, flash
+from flask import current_app, flash, has_request_context
+from sqlalchemy import DDL, and_, event, false, func, inspect, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
-from divvai import process
-from divvai.database import SurrogatePK, db, Column, Model
-from divvai.exceptions import S3FileNotFound
+from divvai import pipeline, process
+from divvai.database import SurrogatePK, db, Column, Model, reference_col, relationship
+from divvai.db_events import pending
+from divvai.exceptions import NoDocumentOutline, S3FileNotFound
 from divvai.extensions import images
-from divvai.ocr import (get_text_from_img_aws, get_text_from_img, preprocess_img)
-from divvai.utils import (s3_keysize, upload_file_to_s3, get_upload_file,
-                          readable_filesize, delete_s3_key)
+from divvai.image_loader import load_image
+from divvai.rekognition import RekognitionDispatcher, rekognition_image
+from divvai.vendors.resolver import vendor_index
+from divvai.utils import (cached_s3_keysize, upload_file_to_s3, get_upload_file,
+                          readable_filesize, delete_s3_key, load_ocr,
+                          download_file_from_s3, touch_access_time, file_sha1)
+
+
+# Text search configuration used for Receipt.search_vector
+SEARCH_CONFIG = 'english'
 
 
 class Receipt(SurrogatePK, Model):
     __tablename__ = 'receipts'
+    __table_args__ = (
+        db.Index('ix_receipts_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_receipts_search_text_trgm', 'search_text', postgresql_using='gin',
+                 postgresql_ops={'search_text': 'gin_trgm_ops'}),
+    )
 
     id = Column(db.Integer, primary_key=True)
     img_filename = Column(db.String, nullable=False)
@@ -28,6 +45,38 @@ class Receipt(SurrogatePK, Model):
     text = Column(db.Text, nullable=True)
     is_public = Column(db.Boolean, default=True)
     vendor_id = Column(db.Integer, db.ForeignKey('vendors.id'), nullable=True)
+    subtotal = Column(db.Numeric(10, 2), nullable=True)
+    tax = Column(db.Numeric(10, 2), nullable=True)
+    tip = Column(db.Numeric(10, 2), nullable=True)
+    total = Column(db.Numeric(10, 2), nullable=True)
+    # Quality gate scores, see ocr.quality_scores. quality_issues is a comma
+    # separated list, '' if the image passed and NULL if it was never scored.
+    blur_score = Column(db.Float, nullable=True)
+    brightness = Column(db.Float, nullable=True)
+    clipped_fraction = Column(db.Float, nullable=True)
+    text_density = Column(db.Float, nullable=True)
+    document_area = Column(db.Float, nullable=True)
+    document_aspect = Column(db.Float, nullable=True)
+    quality_issues = Column(db.String, nullable=True)
+    # What produced raw_text, see pipeline.pipeline_info. Receipts whose
+    # fingerprint differs from the current pipeline's are stale.
+    preprocess_type = Column(db.String, nullable=True)
+    ocr_engine = Column(db.String, nullable=True)
+    pipeline_info = Column(db.Text, nullable=True)
+    pipeline_fingerprint = Column(db.String(40), nullable=True, index=True)
+    # Plain text of raw_text + text, and its tsvector on PostgreSQL. Both are
+    # kept up to date by _update_search_columns below and only loaded on access.
+    search_text = db.deferred(Column(db.Text, nullable=True))
+    search_vector = db.deferred(
+        Column(db.Text().with_variant(TSVECTOR(), 'postgresql'), nullable=True))
+    # Bumped on every change to the row or its line items, see
+    # _bump_receipt_versions below. With img_hash it makes up the ETag.
+    version = Column(db.Integer, nullable=False, default=1, server_default='1')
+    img_hash = Column(db.String(40), nullable=True)
+
+    line_items = relationship('LineItem', backref='receipt', lazy='dynamic',
+                              order_by='LineItem.position',
+                              cascade='all, delete-orphan')
 
     def __init__(self, img_filename, url):
         """
@@ -47,6 +96,79 @@ class Receipt(SurrogatePK, Model):
     def preprocessed_img_localpath(self):
         return get_upload_file(self.preprocessed_img_filename)
 
+    @property
+    def etag(self):
+        """
+        Return the validator for responses rendered from this receipt.
+        Receipts without an img_hash (see manage.py hash_images) fall back
+        to id and version.
+        """
+        if self.img_hash is None:
+            return '{}-{}'.format(self.id, self.version)
+        return '{}-{}-{}'.format(self.id, self.version, self.img_hash[:16])
+
+    def set_img_hash(self):
+        """
+        Set img_hash to the sha1 of the image file.
+        """
+        self.img_hash = file_sha1(self.ensure_local_img())
+
+    @property
+    def image(self):
+        """
+        Return the memory-mapped original image.
+
+        The mapping is kept on the instance so every stage of a processing run
+        shares one read and one decode of the file. Use open_image() to have
+        it released afterwards.
+        """
+        mapped = getattr(self, '_mapped_img', None)
+        if mapped is None or mapped.closed or mapped.path != self.img_localpath:
+            mapped = self._mapped_img = load_image(self.ensure_local_img())
+        return mapped
+
+    def ensure_local_img(self):
+        """
+        Return img_localpath, re-fetching the image from S3 if it was evicted
+        and then evicting others to get back within LOCAL_STORAGE_BUDGET.
+        """
+        from divvai.storage import StorageManager
+
+        path = self.img_localpath
+        if os.path.exists(path):
+            touch_access_time(path)
+        elif self.s3_key:
+            download_file_from_s3(self.s3_key, path)
+            try:
+                StorageManager.from_app().evict(keep=(self.img_filename,))
+            except Exception as e:
+                current_app.logger.error("Eviction after fetching %s failed: %s" % (self.img_filename, e))
+        return path
+
+    @contextmanager
+    def open_image(self):
+        """
+        Yield the memory-mapped image, closing it on exit unless it was
+        already open, e.g. by process(), so a run keeps sharing its decodes.
+        """
+        mapped = getattr(self, '_mapped_img', None)
+        was_open = mapped is not None and not mapped.closed
+        try:
+            yield self.image
+        finally:
+            if not was_open:
+                self.close_image()
+
+    def close_image(self):
+        """
+        Release the memory-mapped image and any cached preprocessed image.
+        """
+        mapped = getattr(self, '_mapped_img', None)
+        if mapped is not None:
+            mapped.close()
+        self._mapped_img = None
+        self._preprocessed_img = None
+
     @property
     def in_s3(self):
         """
@@ -67,7 +189,15 @@ class Receipt(SurrogatePK, Model):
         """
         if os.path.exists(self.img_localpath):
             return os.path.getsize(self.img_localpath)
-        flash("img not found: %s" % self.img_localpath, 'error')
+        if self.s3_key:
+            # Local copy evicted by StorageManager
+            try:
+                return self.img_size_s3
+            except S3FileNotFound:
+                pass
+        current_app.logger.error("img not found: %s" % self.img_localpath)
+        if has_request_context():
+            flash("img not found: %s" % self.img_localpath, 'error')
         return 0
 
     @property
@@ -80,15 +210,15 @@ class Receipt(SurrogatePK, Model):
         Return size of img as in s3.
         """
         if self.s3_key:
-            return s3_keysize(self.s3_key)
+            return cached_s3_keysize(self.s3_key)
 
     @property
     def img_obj(self):
         """
         Get img obj.
         """
-        with open(self.img_localpath, 'rb') as f:
-            return f.read()
+        with self.open_image() as image:
+            return image.tobytes()
 
     @property
     def phone_num(self):
@@ -107,30 +237,181 @@ class Receipt(SurrogatePK, Model):
 
     @property
     def date(self):
-        return None
+        if self.raw_text:
+            return process.get_date(process.receipt_text(self.raw_text))
 
     @property
     def price(self):
-        return None
+        return self.total
+
+    def parse_line_items(self):
+        """
+        Replace line items, subtotal, tax and total with those parsed from raw_text.
+        """
+        items, totals = process.parse_receipt_text(process.receipt_text(self.raw_text))
+        for item in self.line_items:
+            db.session.delete(item)
+        for position, (description, price) in enumerate(items):
+            db.session.add(LineItem(receipt=self, position=position,
+                                    description=description, price=price))
+        self.subtotal = totals.get('subtotal')
+        self.tax = totals.get('tax')
+        self.total = totals.get('total')
+        if 'tip' in totals:
+            self.tip = totals['tip']
+        db.session.commit()
+
+    def resolve_vendor(self):
+        """
+        Set vendor from the phone number or header of the receipt text.
+        """
+        vendor_id = vendor_index.resolve(process.receipt_text(self.raw_text))
+        if vendor_id is not None:
+            self.vendor_id = vendor_id
+            db.session.commit()
+        return vendor_id
+
+    def set_quality(self, scores):
+        """
+        Store quality scores and the issues found in them.
+        """
+        self.blur_score = scores['blur']
+        self.brightness = scores['brightness']
+        self.clipped_fraction = scores['clipped']
+        self.text_density = scores['text_density']
+        self.document_area = scores['document_area']
+        self.document_aspect = scores['document_aspect']
+        issues = load_ocr().quality_issues(scores, current_app.config['QUALITY_THRESHOLDS'])
+        self.quality_issues = ','.join(issues)
+
+    def score_quality(self):
+        """
+        Score the image with the quality gate if it hasn't been scored yet.
+        """
+        if self.quality_issues is None:
+            with self.open_image() as image:
+                self.set_quality(load_ocr().quality_scores(image))
+            db.session.commit()
+        return self.issues
+
+    @property
+    def issues(self):
+        return self.quality_issues.split(',') if self.quality_issues else []
+
+    def route_ocr(self, preprocess_type):
+        """
+        Return the preprocess type to OCR the image with, or None to skip OCR.
+
+        Images with a skip issue (blurry, too dark, ...) aren't worth an OCR
+        call. Edge detection needs a document outline, so images without one
+        are rerouted to plain thresholding.
+        """
+        issues = self.score_quality()
+        if set(issues) & set(current_app.config['QUALITY_SKIP_ISSUES']):
+            return None
+        if preprocess_type == 'edge_detection' and 'no document' in issues:
+            return 'threshold'
+        return preprocess_type
 
     def save_preprocessed_img(self, preprocess_type):
-        if self.preprocessed_img_filename and os.path.exists(self.preprocessed_img_localpath):
-            msg = "Deleting Preprocessed Image: %s" % self.preprocessed_img_filename
-            current_app.logger.warning(msg)
-            os.remove(self.preprocessed_img_localpath)
-        img = preprocess_img(self.img_localpath, preprocess_type)
+        # Check the CV stack is enabled before touching any files.
+        ocr = load_ocr()
+        import cv2
+        with self.open_image() as image:
+            img = ocr.preprocess_img(image, preprocess_type)
+        # Hand the decoded result straight to OCR instead of re-reading it.
+        self._preprocessed_img = img
+        old_filename = self.preprocessed_img_filename
         with tempfile.NamedTemporaryFile(delete=True, prefix='preprocessed', suffix='.jpg') as tmp_fh:
             cv2.imwrite(tmp_fh.name, img)
             self.preprocessed_img_filename = images.save(FileStorage(tmp_fh, filename=tmp_fh.name))
+        self.preprocess_type = preprocess_type
         db.session.commit()
+        # Only drop the old image once the new one is saved and referenced.
+        old_path = get_upload_file(old_filename) if old_filename else None
+        if old_path and old_filename != self.preprocessed_img_filename and os.path.exists(old_path):
+            current_app.logger.warning("Deleting Preprocessed Image: %s" % old_filename)
+            os.remove(old_path)
 
     def get_text_from_img(self):
-        if self.preprocessed_img_filename:
-            self.raw_text = get_text_from_img(self.preprocessed_img_localpath)
+        ocr = load_ocr()
+        preprocessed = getattr(self, '_preprocessed_img', None)
+        preprocess_type = self.preprocess_type
+        if preprocessed is not None:
+            source = nullcontext(preprocessed)
+        elif self.preprocessed_img_filename:
+            source = nullcontext(self.preprocessed_img_localpath)
         else:
-            self.raw_text = get_text_from_img(self.img_localpath)
+            source = self.open_image()
+            preprocess_type = None
+        config = current_app.config
+        tile_options = tile_options_from_config(config)
+        with source as image:
+            if tile_options:
+                self.raw_text = ocr.get_text_from_img_tiled(
+                    image, workers=config['OCR_TILE_WORKERS'], **tile_options)
+            else:
+                self.raw_text = ocr.get_text_from_img(image)
+        self.set_pipeline(ocr.pipeline_info(preprocess_type, 'tesseract', tile_options))
         db.session.commit()
 
+    def set_pipeline(self, info):
+        """
+        Record what produced raw_text and its fingerprint.
+        """
+        self.ocr_engine = info['engine']
+        if info['engine'] == 'rekognition':
+            self.preprocess_type = None
+        self.pipeline_info = json.dumps(info, sort_keys=True)
+        self.pipeline_fingerprint = pipeline.pipeline_fingerprint(info)
+
+    @classmethod
+    def stale_query(cls):
+        """
+        Return a query of processed receipts whose pipeline fingerprint differs
+        from the current pipeline's, including never fingerprinted ones.
+        """
+        tile_options = tile_options_from_config(current_app.config)
+        conditions = [and_(cls.raw_text.isnot(None), cls.pipeline_fingerprint.is_(None))]
+        combos = db.session.query(cls.ocr_engine, cls.preprocess_type) \
+            .filter(cls.pipeline_fingerprint.isnot(None)).distinct()
+        for engine, preprocess_type in combos:
+            if engine == 'rekognition':
+                info = pipeline.pipeline_info(preprocess_type, engine, tile_options)
+            else:
+                info = load_ocr().pipeline_info(preprocess_type, engine, tile_options)
+            conditions.append(and_(
+                cls.ocr_engine == engine,
+                cls.preprocess_type.is_(None) if preprocess_type is None
+                else cls.preprocess_type == preprocess_type,
+                cls.pipeline_fingerprint != pipeline.pipeline_fingerprint(info)))
+        return cls.query.filter(or_(*conditions) if conditions else false())
+
+    def process(self, preprocess_type='edge_detection', force=False):
+        """
+        Preprocess the image, OCR it with tesseract and parse the text.
+
+        Returns the preprocess type used, which the quality gate may have
+        rerouted, or None if the gate skipped OCR (unless force is set).
+        Edge detection falls back to thresholding when no document outline
+        is found, since the gate can't always predict that.
+        """
+        with self.open_image():
+            if not force:
+                preprocess_type = self.route_ocr(preprocess_type)
+                if preprocess_type is None:
+                    return None
+            try:
+                self.save_preprocessed_img(preprocess_type)
+            except NoDocumentOutline as e:
+                current_app.logger.warning("Receipt[%s] %s Using threshold." % (self.id, e))
+                preprocess_type = 'threshold'
+                self.save_preprocessed_img(preprocess_type)
+            self.get_text_from_img()
+        self.parse_line_items()
+        self.resolve_vendor()
+        return preprocess_type
+
     def safe_s3_upload(self):
         """
         Upload img to s3 if it doesn't exist or the size doesn't match.
@@ -176,22 +457,145 @@ class Receipt(SurrogatePK, Model):
         """
         Safely get text from img.
         """
+        response = RekognitionDispatcher.from_app().detect_text(self.rekognition_image())
+        self.set_rekognition_response(response)
+
+    def rekognition_image(self):
+        """
+        Return the Rekognition Image argument for the img.
+        """
         # Images larger than 5 MB need to be in S3.
-        if self.img_size >= 1048576:
+        if self.img_size >= 5 * 1024 * 1024:
             self.set_s3_key()
             self.safe_s3_upload()
-            self.get_text_from_img()
-        else:
-            self.get_text_from_img(img_bytes=self.img_obj)
+            return rekognition_image(key=self.s3_key)
+        return rekognition_image(img_bytes=self.img_obj)
 
     def get_text_from_img_aws(self, img_bytes=None):
         """
         Set JSON values.
         """
         if not img_bytes:
-            text = get_text_from_img_aws(key=self.s3_key)
+            image = rekognition_image(key=self.s3_key)
         else:
-            text = get_text_from_img_aws(img_bytes=img_bytes)
-        current_app.logger.info("Retrieved text: %s" % text)
-        self.raw_text = json.dumps(text)
+            image = rekognition_image(img_bytes=img_bytes)
+        self.set_rekognition_response(RekognitionDispatcher.from_app().detect_text(image))
+
+    def set_rekognition_response(self, response):
+        current_app.logger.info("Retrieved text: %s" % response)
+        self.raw_text = json.dumps(response)
+        info = pipeline.pipeline_info(None, 'rekognition')
+        self.set_pipeline(info)
+        # Recorded for reference, the fingerprint doesn't include it.
+        self.pipeline_info = json.dumps(
+            dict(info, model_version=response.get('TextModelVersion')), sort_keys=True)
         db.session.commit()
+
+
+def tile_options_from_config(config):
+    """
+    Return the tiled OCR options from app config, None if tiling is off.
+    """
+    if not config.get('OCR_TILED'):
+        return None
+    return {'strip_height': config['OCR_TILE_HEIGHT'], 'overlap': config['OCR_TILE_OVERLAP']}
+
+
+# gin_trgm_ops needs the pg_trgm extension.
+event.listen(
+    Receipt.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+def set_search_columns(receipt, dialect_name):
+    """
+    Set search_text (and search_vector on PostgreSQL) from raw_text and text.
+    """
+    receipt.search_text = '\n'.join(
+        t for t in (process.receipt_text(receipt.raw_text), receipt.text) if t) or None
+    if dialect_name == 'postgresql':
+        receipt.search_vector = func.to_tsvector(SEARCH_CONFIG, receipt.search_text or '')
+
+
+@event.listens_for(Receipt, 'before_insert')
+@event.listens_for(Receipt, 'before_update')
+def _update_search_columns(mapper, connection, receipt):
+    """
+    Recompute the search columns when raw_text or text changes.
+    """
+    state = inspect(receipt)
+    if any(state.attrs[key].history.has_changes() for key in ('raw_text', 'text')):
+        set_search_columns(receipt, connection.dialect.name)
+
+
+class LineItem(SurrogatePK, Model):
+    __tablename__ = 'line_items'
+
+    id = Column(db.Integer, primary_key=True)
+    receipt_id = reference_col('receipts', index=True)
+    position = Column(db.Integer, nullable=False, default=0)
+    description = Column(db.String, nullable=False)
+    price = Column(db.Numeric(10, 2), nullable=False)
+
+    assignments = relationship('ItemAssignment', backref='line_item', lazy='selectin',
+                               cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return '<LineItem: {} {}>'.format(self.description, self.price)
+
+    @property
+    def participants(self):
+        return [assignment.participant for assignment in self.assignments]
+
+    def assign(self, participants):
+        """
+        Assign item to participants, replacing any previous assignment.
+        """
+        self.assignments = [ItemAssignment(participant=p) for p in dict.fromkeys(participants)]
+
+
+class ItemAssignment(SurrogatePK, Model):
+    """
+    A participant sharing a line item. Items are split evenly between them.
+    """
+    __tablename__ = 'item_assignments'
+    __table_args__ = (
+        db.UniqueConstraint('line_item_id', 'participant'),
+    )
+
+    id = Column(db.Integer, primary_key=True)
+    line_item_id = reference_col('line_items', index=True)
+    participant = Column(db.String(50), nullable=False)
+
+
+def _receipt_id(obj):
+    if isinstance(obj, Receipt):
+        return obj.id
+    if isinstance(obj, LineItem):
+        return obj.receipt_id or (obj.receipt.id if obj.receipt is not None else None)
+    if isinstance(obj, ItemAssignment) and obj.line_item is not None:
+        return _receipt_id(obj.line_item)
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_receipt_versions(session, flush_context, instances):
+    """
+    Bump the version of receipts changed in this flush, directly or through
+    their line items, and remember their ids in session.info['receipts_changed']
+    so caches can be invalidated once the transaction commits.
+    """
+    changed = set()
+    for obj in chain(session.dirty, session.deleted, session.new):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        receipt_id = _receipt_id(obj)
+        if receipt_id is not None:
+            changed.add(receipt_id)
+    if not changed:
+        return
+    pending(session, 'receipts_changed', set).update(changed)
+    for receipt_id in changed:
+        receipt = session.get(Receipt, receipt_id)
+        if receipt is not None and receipt not in session.deleted:
+            # SQL side increment, so concurrent writers never reuse a version.
+            receipt.version = Receipt.version + 1
@@ -0,0 +1,202 @@
+"""search.py
+
+Full-text search over receipt text.
+
+On PostgreSQL this is a ``tsvector`` match (GIN indexed) OR'd with a pg_trgm
+word similarity match (GIN indexed) so OCR misspellings still hit. Other
+databases, e.g. SQLite in tests, use the in-memory SearchIndex below.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, func, inspect, literal, or_, select
+from sqlalchemy.orm import object_session
+
+from divvai import process
+from divvai.database import db
+from divvai.db_events import on_commit, pending
+from divvai.receipts.models import Receipt, SEARCH_CONFIG, set_search_columns
+
+
+def tokenize(s):
+    return process.normalize_name(s or '').split()
+
+
+class SearchIndex(object):
+    """
+    In-memory inverted index of receipt search_text.
+
+    Every query term must match a receipt, either exactly or through a word
+    whose trigram similarity to the term is at least ``min_similarity``.
+    Results are ranked by the number of exactly matched terms.
+
+    Like the vendor index it is per process: other processes' commits show
+    up once it is rebuilt, at most ``max_age`` seconds after the last build.
+    """
+
+    def __init__(self, min_similarity=0.5, max_age=300):
+        self.min_similarity = min_similarity
+        self.max_age = max_age
+        self.loaded = False
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._receipts_by_word = defaultdict(set)
+        self._words_by_receipt = {}
+        self._words_by_gram = defaultdict(set)
+        self._grams_by_word = {}
+
+    def load(self):
+        """
+        (Re)build the index from every receipt in the db.
+        """
+        rows = Receipt.query.with_entities(Receipt.id, Receipt.search_text) \
+            .filter(Receipt.search_text.isnot(None)).all()
+        with self._lock:
+            self._clear()
+            for receipt_id, search_text in rows:
+                self.add(receipt_id, search_text)
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if not self.loaded or (self.max_age is not None
+                               and time.monotonic() - self.loaded_at > self.max_age):
+            self.load()
+
+    def add(self, receipt_id, search_text):
+        with self._lock:
+            self.remove(receipt_id)
+            words = set(tokenize(search_text))
+            self._words_by_receipt[receipt_id] = words
+            for word in words:
+                self._receipts_by_word[word].add(receipt_id)
+                if word not in self._grams_by_word:
+                    grams = process.trigrams(word)
+                    self._grams_by_word[word] = grams
+                    for gram in grams:
+                        self._words_by_gram[gram].add(word)
+
+    def remove(self, receipt_id):
+        with self._lock:
+            for word in self._words_by_receipt.pop(receipt_id, ()):
+                self._receipts_by_word[word].discard(receipt_id)
+
+    def similar_words(self, term):
+        """
+        Return indexed words with trigram similarity >= min_similarity to term.
+        """
+        grams = process.trigrams(term)
+        candidates = set()
+        for gram in grams:
+            candidates.update(self._words_by_gram.get(gram, ()))
+        similar = set()
+        for word in candidates:
+            word_grams = self._grams_by_word[word]
+            overlap = len(grams & word_grams)
+            if overlap / float(len(grams | word_grams)) >= self.min_similarity:
+                similar.add(word)
+        return similar
+
+    def search(self, query, limit=50):
+        """
+        Return receipt ids matching every term of query, best match first.
+        """
+        self.ensure_loaded()
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            matches = None
+            exact = defaultdict(int)
+            for term in terms:
+                term_matches = set()
+                for word in self.similar_words(term) | {term}:
+                    term_matches |= self._receipts_by_word.get(word, set())
+                for receipt_id in self._receipts_by_word.get(term, ()):
+                    exact[receipt_id] += 1
+                matches = term_matches if matches is None else matches & term_matches
+            return sorted(matches, key=lambda i: (-exact[i], -i))[:limit]
+
+
+search_index = SearchIndex()
+
+
+def _pending(receipt):
+    return pending(object_session(receipt), 'search_index_changes')
+
+
+@event.listens_for(Receipt, 'after_insert')
+@event.listens_for(Receipt, 'after_update')
+def _index_receipt(mapper, connection, receipt):
+    if inspect(receipt).attrs.search_text.history.has_changes():
+        _pending(receipt)[receipt.id] = receipt.search_text
+
+
+@event.listens_for(Receipt, 'after_delete')
+def _unindex_receipt(mapper, connection, receipt):
+    _pending(receipt)[receipt.id] = None
+
+
+@on_commit('search_index_changes')
+def _apply_search_changes(changes):
+    if not search_index.loaded:
+        return
+    for receipt_id, text in changes.items():
+        if text is None:
+            search_index.remove(receipt_id)
+        else:
+            search_index.add(receipt_id, text)
+
+
+def reindex_receipts(all_receipts=False, batch_size=500):
+    """
+    Fill in the search columns of receipts with text but no search_text,
+    e.g. ones from before search existed (or of all of them with
+    all_receipts), committing every batch_size. Returns the number reindexed.
+    """
+    query = Receipt.query.filter(or_(Receipt.raw_text.isnot(None), Receipt.text.isnot(None)))
+    if not all_receipts:
+        query = query.filter(Receipt.search_text.is_(None))
+    dialect_name = db.engine.dialect.name
+    last_id = count = 0
+    while True:
+        batch = query.filter(Receipt.id > last_id).order_by(Receipt.id).limit(batch_size).all()
+        if not batch:
+            return count
+        for receipt in batch:
+            set_search_columns(receipt, dialect_name)
+        db.session.commit()
+        last_id = batch[-1].id
+        count += len(batch)
+
+
+def search_receipts(query, limit=50, max_candidates=1000):
+    """
+    Return receipts whose text matches query, best match first.
+
+    On PostgreSQL only the first max_candidates matches found are ranked, so
+    a query matching most receipts doesn't rank them all; such a query may
+    miss better matches beyond the cap.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        ids = search_index.search(query, limit)
+        receipts = {r.id: r for r in Receipt.query.filter(Receipt.id.in_(ids))} if ids else {}
+        return [receipts[i] for i in ids if i in receipts]
+
+    tsquery = func.plainto_tsquery(SEARCH_CONFIG, query)
+    # `query <% search_text` is pg_trgm word similarity, served by the trigram index.
+    fuzzy = literal(query).op('<%')(Receipt.search_text)
+    candidates = db.session.query(Receipt.id) \
+        .filter(or_(Receipt.search_vector.op('@@')(tsquery), fuzzy)) \
+        .limit(max_candidates) \
+        .subquery()
+    return Receipt.query \
+        .filter(Receipt.id.in_(select(candidates.c.id))) \
+        .order_by(func.ts_rank(Receipt.search_vector, tsquery).desc(),
+                  func.word_similarity(query, Receipt.search_text).desc()) \
+        .limit(limit) \
+        .all()
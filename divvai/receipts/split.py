@@ -0,0 +1,100 @@
+"""split.py
+
+Who owes what: split receipt line items between participants.
+
+All amounts are Decimals and every allocation is exact to the cent, i.e. the
+per-person amounts always add back up to the receipt amounts.
+"""
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, ROUND_FLOOR
+from itertools import groupby
+
+from divvai.database import db
+from divvai.receipts.models import Receipt, LineItem, ItemAssignment
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+# Participant charged for line items nobody has been assigned.
+UNASSIGNED = 'unassigned'
+
+
+def allocate(amount, weights):
+    """
+    Return OrderedDict of key -> share of ``amount`` proportional to weights.
+
+    Shares are floored to the cent and the leftover cents go to the largest
+    remainders (ties broken by key order), so they sum exactly to amount.
+    Equal weights are used if the weights sum to zero.
+    """
+    amount = Decimal(amount or 0).quantize(CENT)
+    keys = list(weights)
+    if not keys:
+        return OrderedDict()
+    total_weight = sum(weights.values())
+    if not total_weight:
+        weights = dict.fromkeys(keys, 1)
+        total_weight = len(keys)
+    exact = [amount * Decimal(weights[k]) / Decimal(total_weight) for k in keys]
+    shares = [e.quantize(CENT, rounding=ROUND_FLOOR) for e in exact]
+    leftover_cents = int((amount - sum(shares)) / CENT)
+    by_remainder = sorted(range(len(keys)), key=lambda i: shares[i] - exact[i])
+    for i in by_remainder[:leftover_cents]:
+        shares[i] += CENT
+    return OrderedDict(zip(keys, shares))
+
+
+def split_receipt(items, tax=None, tip=None):
+    """
+    Return {participant: {'subtotal', 'tax', 'tip', 'total'}} for one receipt.
+
+    :param items: iterable of (price, participants); each item is split evenly
+        between its participants, or charged to UNASSIGNED if there are none
+    :param tax: receipt tax, allocated proportionally to each subtotal
+    :param tip: receipt tip, allocated proportionally to each subtotal
+    """
+    subtotals = defaultdict(lambda: ZERO)
+    for price, participants in items:
+        participants = list(participants) or [UNASSIGNED]
+        for participant, share in allocate(price, dict.fromkeys(participants, 1)).items():
+            subtotals[participant] += share
+    subtotals = OrderedDict(sorted(subtotals.items()))
+    tax_shares = allocate(tax, subtotals)
+    tip_shares = allocate(tip, subtotals)
+
+    result = OrderedDict()
+    for participant, subtotal in subtotals.items():
+        result[participant] = {
+            'subtotal': subtotal,
+            'tax': tax_shares[participant],
+            'tip': tip_shares[participant],
+            'total': subtotal + tax_shares[participant] + tip_shares[participant],
+        }
+    return result
+
+
+def settle(receipt_ids):
+    """
+    Return {participant: {'subtotal', 'tax', 'tip', 'total'}} across receipts.
+
+    Every item, assignment, tax and tip is fetched in a single query and the
+    rows are split in one pass, instead of loading each receipt's items.
+    """
+    rows = db.session.query(
+        Receipt.id, Receipt.tax, Receipt.tip,
+        LineItem.id, LineItem.price, ItemAssignment.participant
+    ).join(LineItem, LineItem.receipt_id == Receipt.id) \
+        .outerjoin(ItemAssignment, ItemAssignment.line_item_id == LineItem.id) \
+        .filter(Receipt.id.in_(list(receipt_ids))) \
+        .order_by(Receipt.id, LineItem.id) \
+        .all()
+
+    totals = defaultdict(lambda: dict.fromkeys(('subtotal', 'tax', 'tip', 'total'), ZERO))
+    for (_, tax, tip), receipt_rows in groupby(rows, key=lambda row: row[:3]):
+        items = []
+        for (_, price), item_rows in groupby(receipt_rows, key=lambda row: row[3:5]):
+            items.append((price, [row[5] for row in item_rows if row[5] is not None]))
+        for participant, amounts in split_receipt(items, tax, tip).items():
+            for key, amount in amounts.items():
+                totals[participant][key] += amount
+    return OrderedDict(sorted(totals.items()))
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
 
-from flask import (Blueprint, render_template, redirect, url_for,
-                   request, current_app, flash, send_from_directory)
+from flask import (Blueprint, render_template, redirect, url_for, jsonify, abort,
+                   request, current_app, flash, send_from_directory, session,
+                   make_response)
 
 from divvai.database import db
+from divvai.exceptions import CVStackDisabled
 from divvai.forms import UploadReceiptForm, ProcessReceiptForm
-from divvai.receipts.models import Receipt
+from divvai.receipts.cache import receipt_detail_entry
+from divvai.receipts.models import Receipt, LineItem
+from divvai.receipts.search import search_receipts
+from divvai.receipts.split import settle
 from divvai.extensions import images
 
 
@@ -24,6 +29,7 @@ def upload_receipt():
             filename = images.save(request.files['receipt_image'])
             url = images.url(filename)
             new_receipt = Receipt(filename, url)
+            new_receipt.set_img_hash()
             db.session.add(new_receipt)
             db.session.commit()
             msg = "New receipt, {}, added!".format(new_receipt.img_filename)
@@ -47,12 +53,38 @@ def all_receipts(receipts=None):
     return render_template('receipts/all_receipts.html', receipts=receipts)
 
 
+@blueprint.route('/search')
+def search():
+    """
+    Display receipts whose text matches ?q=.
+    """
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 100)
+    receipts = search_receipts(query, limit=limit) if query else []
+    return render_template('receipts/all_receipts.html', receipts=receipts, query=query)
+
+
+def _not_modified(etag):
+    """
+    Return a 304 response if the request's If-None-Match matches etag.
+    """
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+
 @blueprint.route('/<receipt_id>', methods=['GET', 'POST'])
 def receipt_detail(receipt_id):
     """
     Show receipt details, including a modal/form for processing.
+
+    The receipt body is rendered from the cache, and a client that already
+    has the current page gets a 304 unless there are flashed messages to show.
     """
-    receipt = Receipt.query.get(receipt_id)
+    detail = receipt_detail_entry(receipt_id)
+    if detail is None:
+        abort(404)
     form = ProcessReceiptForm()
     if request.method == 'POST':
         if form.validate_on_submit():
@@ -60,7 +92,19 @@ def receipt_detail(receipt_id):
                                     preprocess_type=form.preprocess_type.data))
         else:
             flash('Form validation failed for form.', 'error')
-    return render_template('receipts/receipt_detail.html', receipt=receipt, form=form)
+    flashes = '_flashes' in session
+    if request.method == 'GET' and not flashes:
+        not_modified = _not_modified(detail['etag'])
+        if not_modified:
+            return not_modified
+    response = make_response(render_template('receipts/receipt_detail.html', detail=detail, form=form))
+    if flashes:
+        response.cache_control.no_store = True
+    else:
+        response.set_etag(detail['etag'])
+        response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
 
 
 @blueprint.route("/<receipt_id>/api/process/<preprocess_type>")
@@ -68,12 +112,23 @@ def process_receipt(receipt_id, preprocess_type='edge_detection'):
     """
     """
     receipt = Receipt.query.get(receipt_id)
-    if receipt.raw_text:
+    reprocessed = bool(receipt.raw_text)
+    try:
+        routed_type = receipt.process(preprocess_type, force=request.args.get('force', type=int))
+    except CVStackDisabled as e:
+        flash(str(e), 'error')
+        return redirect(url_for('.receipt_detail', receipt_id=receipt_id))
+    if routed_type is None:
+        flash("Not processing %s: %s. Add ?force=1 to process anyway."
+              % (receipt.img_filename, ', '.join(receipt.issues)), 'warning')
+        return redirect(url_for('.receipt_detail', receipt_id=receipt_id))
+    if routed_type != preprocess_type:
+        flash("No document outline found, used %s instead of %s."
+              % (routed_type, preprocess_type), 'warning')
+    if reprocessed:
         flash("Text for %s reprocessed" % receipt.img_filename, 'warning')
     else:
         flash("Text for %s processed" % receipt.img_filename)
-    receipt.save_preprocessed_img(preprocess_type)
-    receipt.get_text_from_img()
     return redirect(url_for('.receipt_detail', receipt_id=receipt_id))
 
 
@@ -83,9 +138,13 @@ def delete_receipt(receipt_id):
     Delete receipt from db and delete local img.
     """
     receipt = Receipt.query.get(receipt_id)
-    if os.path.exists(receipt.img_localpath):
-        os.remove(receipt.img_localpath)
-        current_app.logger.warning("Deleted local img: %s" % receipt.img_localpath)
+    paths = [receipt.img_localpath]
+    if receipt.preprocessed_img_filename:
+        paths.append(receipt.preprocessed_img_localpath)
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            current_app.logger.warning("Deleted local img: %s" % path)
     if receipt.s3_key:
         receipt.delete_s3_key()
     db.session.delete(receipt)
@@ -96,14 +155,37 @@ def delete_receipt(receipt_id):
 
 @blueprint.route("/<receipt_id>/api/img/<_type>")
 def img_link(receipt_id, _type):
-    receipt = Receipt.query.get(receipt_id)
+    """
+    Send the original or preprocessed image with a strong ETag.
+
+    The original never changes, so it may be reused for RECEIPT_IMG_MAX_AGE.
+    Preprocessed images get a new filename on every run and are revalidated.
+    """
+    detail = receipt_detail_entry(receipt_id)
+    if detail is None:
+        abort(404)
     upload_folder = current_app.config.get('UPLOAD_IMAGE_DIR')
     if _type == 'base':
-        return send_from_directory(upload_folder, receipt.img_filename)
+        etag, max_age = detail['img_hash'] or detail['etag'], current_app.config['RECEIPT_IMG_MAX_AGE']
+        filename = detail['img_filename']
     elif _type == 'preprocessed':
-        return send_from_directory(upload_folder, receipt.preprocessed_img_filename)
+        etag, max_age = detail['preprocessed_img_filename'], 0
+        filename = detail['preprocessed_img_filename']
+        if filename is None:
+            abort(404)
     else:
         raise TypeError("Recieved invalid _type parameter: %s" % _type)
+    response = _not_modified(etag)
+    if response is None:
+        if _type == 'base':
+            Receipt.query.get(receipt_id).ensure_local_img()
+        response = send_from_directory(upload_folder, filename, etag=etag, max_age=max_age)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    if not max_age:
+        response.cache_control.no_cache = True
+    return response
 
 
 @blueprint.route("/<receipt_id>/api/s3")
@@ -118,3 +200,36 @@ def put_img_s3(receipt_id):
         receipt.safe_s3_upload()
         flash("Receipt[%s] uploaded to s3." % receipt_id)
     return redirect(url_for('.receipt_detail', receipt_id=receipt_id))
+
+
+def _settlement_json(totals):
+    return jsonify({participant: {key: str(amount) for key, amount in amounts.items()}
+                    for participant, amounts in totals.items()})
+
+
+@blueprint.route("/<receipt_id>/api/items/<item_id>/assign", methods=['POST'])
+def assign_line_item(receipt_id, item_id):
+    """
+    Assign a line item to the comma separated participants in the form.
+    """
+    item = LineItem.query.filter_by(id=item_id, receipt_id=receipt_id).first_or_404()
+    participants = [p.strip() for p in request.form.get('participants', '').split(',')]
+    item.assign([p for p in participants if p])
+    db.session.commit()
+    return jsonify({'id': item.id, 'participants': item.participants})
+
+
+@blueprint.route("/<receipt_id>/api/split")
+def split_receipt(receipt_id):
+    """
+    Return what each participant owes for a receipt.
+    """
+    return _settlement_json(settle([receipt_id]))
+
+
+@blueprint.route("/api/settle")
+def settle_receipts():
+    """
+    Return what each participant owes across ?receipt_id=1&receipt_id=2...
+    """
+    return _settlement_json(settle(request.args.getlist('receipt_id', type=int)))
@@ -0,0 +1,244 @@
+"""rekognition.py
+
+Rate limited, concurrent Rekognition calls with adaptive retries.
+
+Bulk reprocessing can issue far more detect_text calls than the account
+quota allows. The dispatcher paces calls with a token bucket, runs them on a
+bounded thread pool and retries throttled calls with jittered exponential
+backoff, halving the request rate on each throttle and slowly recovering it
+on success.
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+
+THROTTLING_ERRORS = (
+    'ThrottlingException',
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+    'TooManyRequestsException',
+)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket allowing ``rate`` calls per second on average
+    and bursts of up to ``capacity`` calls.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def try_acquire(self):
+        """
+        Take a token if one is available, without blocking.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def is_throttling_error(exc):
+    response = getattr(exc, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+
+def rekognition_client(endpoint_url=None, max_pool_connections=10):
+    """
+    Return a Rekognition client with botocore's own retries turned off, since
+    the dispatcher does its own rate-aware retrying.
+    """
+    import boto3
+    from botocore.config import Config
+    config = Config(retries={'max_attempts': 0}, max_pool_connections=max_pool_connections)
+    return boto3.client('rekognition', endpoint_url=endpoint_url, config=config)
+
+
+def rekognition_image(key=None, img_bytes=None):
+    """
+    Return the Rekognition Image argument for an s3 key or image bytes.
+    """
+    if key:
+        bucket = current_app.config['UPLOAD_BUCKET']
+        return {'S3Object': {'Bucket': bucket, 'Name': key}}
+    elif img_bytes:
+        return {'Bytes': img_bytes}
+    e = "One of these parameters must be set: (key, img_bytes)"
+    raise ValueError(e)
+
+
+class RekognitionDispatcher(object):
+    """
+    Paces, parallelizes and retries Rekognition detect_text calls.
+    """
+
+    def __init__(self, client=None, rate=5.0, max_workers=8, max_retries=8, max_requeues=4,
+                 base_delay=0.25, max_delay=20.0, min_rate=0.5, endpoint_url=None):
+        """
+        :param client: Rekognition client, created from endpoint_url if None
+        :param rate: target calls per second, e.g. the account's TPS quota
+        :param max_workers: maximum concurrent calls
+        :param max_retries: retries of a throttled call before giving up
+        :param max_requeues: times map() puts a call that gave up throttled
+            back at the end of its queue before yielding the error
+        :param base_delay: first backoff delay in seconds, doubled each retry
+        :param max_delay: maximum backoff delay in seconds
+        :param min_rate: the rate is never lowered below this on throttling
+        """
+        self.client = client or rekognition_client(endpoint_url, max_pool_connections=max_workers)
+        self.target_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.max_requeues = max_requeues
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(rate)
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    @classmethod
+    def from_app(cls, app=None):
+        """
+        Return the app's dispatcher, creating it from config on first use.
+        """
+        app = app or current_app._get_current_object()
+        dispatcher = app.extensions.get('rekognition')
+        if dispatcher is None:
+            config = app.config
+            dispatcher = app.extensions['rekognition'] = cls(
+                rate=config['REKOGNITION_RATE'],
+                max_workers=config['REKOGNITION_MAX_WORKERS'],
+                max_retries=config['REKOGNITION_MAX_RETRIES'],
+                max_requeues=config['REKOGNITION_MAX_REQUEUES'],
+                endpoint_url=config.get('REKOGNITION_ENDPOINT_URL'))
+        return dispatcher
+
+    def _on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.bucket.set_rate(max(self.min_rate, self.bucket.rate / 2.0))
+
+    def _on_success(self):
+        if self.bucket.rate < self.target_rate:
+            with self._lock:
+                self.bucket.set_rate(min(self.target_rate, self.bucket.rate + 0.1 * self.target_rate))
+
+    def detect_text(self, image):
+        """
+        Return the detect_text response for image, retrying when throttled.
+
+        :param image: the Rekognition Image argument, {'Bytes': ...} or
+            {'S3Object': {'Bucket': ..., 'Name': ...}}
+        """
+        from botocore.exceptions import ClientError
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.client.detect_text(Image=image)
+            except ClientError as e:
+                if not is_throttling_error(e) or attempt == self.max_retries:
+                    raise
+                self._on_throttle()
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+            else:
+                self._on_success()
+                return response
+
+    def submit(self, image):
+        """
+        Return a Future of detect_text(image).
+        """
+        return self._pool.submit(self.detect_text, image)
+
+    def map(self, items):
+        """
+        Yield (key, response, exception) for (key, image) items as they finish.
+
+        An image may be a callable returning the Image argument, called when
+        the item is queued. At most ``2 * max_workers`` calls are queued at
+        once, so items can be a lazy generator over a large backlog. Calls
+        still throttled after max_retries go to the back of the queue, up to
+        max_requeues times. Failed calls, and images that fail to build, are
+        yielded with their exception rather than raised, so one bad image
+        doesn't stop the batch.
+        """
+        items = iter(items)
+        pending = {}
+        requeued = deque()
+        failed = []
+
+        def fill():
+            while len(pending) < 2 * self.max_workers:
+                if requeued:
+                    key, image, requeues = requeued.popleft()
+                else:
+                    try:
+                        key, image = next(items)
+                    except StopIteration:
+                        return
+                    requeues = 0
+                    if callable(image):
+                        try:
+                            image = image()
+                        except Exception as e:
+                            failed.append((key, None, e))
+                            continue
+                pending[self.submit(image)] = (key, image, requeues)
+
+        fill()
+        while pending or failed:
+            for result in failed:
+                yield result
+            del failed[:]
+            if not pending:
+                fill()
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, image, requeues = pending.pop(future)
+                exc = future.exception()
+                if exc is not None and is_throttling_error(exc) and requeues < self.max_requeues:
+                    requeued.append((key, image, requeues + 1))
+                    continue
+                yield key, (None if exc else future.result()), exc
+            fill()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -23,9 +23,59 @@ class DefaultConfig(object):
     # Flask-Uploads config
     UPLOADED_FILES_ALLOW = set(['png', 'jpg', 'jpeg', 'gif'])
     UPLOADS_DEFAULT_DEST = os.path.join(APP_DIR, 'uploads')
+    UPLOADS_AUTOSERVE = True  # Flask-Reuploaded only serves uploads when set
     UPLOAD_BUCKET = os.environ.get('UPLOAD_BUCKET', 'receipt-divvai')
     IMAGE_SET_NAME = 'images'
     UPLOAD_IMAGE_DIR = os.path.join(UPLOADS_DEFAULT_DEST, IMAGE_SET_NAME)
+    # Bytes of local disk for uploads before S3-backed originals are evicted,
+    # whenever an evicted image is re-fetched and by `manage.py evict_uploads`
+    # (run it periodically, e.g. from cron, as new uploads don't evict)
+    LOCAL_STORAGE_BUDGET = int(os.environ['LOCAL_STORAGE_BUDGET']) \
+        if os.environ.get('LOCAL_STORAGE_BUDGET') else None
+    ORPHAN_MIN_AGE = 3600  # seconds before unreferenced uploads are swept
+
+    # Web-only nodes serve pages but never import the OCR/CV stack
+    WEB_ONLY = os.environ.get('WEB_ONLY', '').lower() in ('1', 'true', 'yes')
+
+    # Quality gate run before OCR, see ocr.quality_scores / ocr.quality_issues
+    QUALITY_THRESHOLDS = {
+        'min_blur': 100.0,
+        'min_brightness': 0.2,
+        'max_brightness': 0.9,
+        'max_clipped': 0.5,
+        'min_text_density': 0.004,
+        'min_document_area': 0.1,  # no lower than PREPROCESS_PARAMS['min_outline_area']
+        'min_document_aspect': 1.2,
+    }
+    # Issues that skip OCR entirely; 'no document' only reroutes edge detection
+    QUALITY_SKIP_ISSUES = ('blurry', 'too dark', 'overexposed', 'clipped exposure', 'no text')
+
+    # Tesseract on long receipts: OCR overlapping strips in parallel
+    OCR_TILED = True
+    OCR_TILE_HEIGHT = 1200
+    OCR_TILE_OVERLAP = 60
+    OCR_TILE_WORKERS = None  # defaults to os.cpu_count()
+
+    # Rekognition dispatcher, see divvai.rekognition
+    REKOGNITION_RATE = float(os.environ.get('REKOGNITION_RATE', 5.0))  # calls per second
+    REKOGNITION_MAX_WORKERS = 8
+    REKOGNITION_MAX_RETRIES = 8
+    REKOGNITION_MAX_REQUEUES = 4  # times a call throttled past its retries is re-queued
+    REKOGNITION_ENDPOINT_URL = os.environ.get('REKOGNITION_ENDPOINT_URL')  # e.g. divvai.stubs
+
+    # Server-side cache of rendered receipt pages and S3 status checks.
+    # Without a shared backend each process keeps its own SimpleCache;
+    # receipt pages are checked against the receipt's version on read, so
+    # changes committed by another process are never served stale.
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or ('RedisCache' if CACHE_REDIS_URL else 'SimpleCache')
+    CACHE_DEFAULT_TIMEOUT = 300
+    S3_STATUS_CACHE_TIMEOUT = 60
+    RECEIPT_IMG_MAX_AGE = 3600  # browsers reuse the original image this long
+
+    # S3 through localstack instead of AWS
+    LOCALSTACK = False
+    S3_LOCALSTACK_HOST = os.environ.get('S3_LOCALSTACK_HOST')
 
     TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 
@@ -0,0 +1,146 @@
+"""storage.py
+
+Track and reclaim local disk used by uploads in UPLOAD_IMAGE_DIR.
+
+Files are classified into tiers:
+
+- original: receipt images only on local disk
+- original_s3: receipt images also in S3, safe to evict and re-fetch
+- preprocessed: current preprocessed images
+- orphaned: files no receipt references (old preprocessed images, failed runs)
+"""
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+
+from divvai.database import db
+from divvai.exceptions import S3FileNotFound
+from divvai.receipts.models import Receipt
+from divvai.utils import s3_keysize
+
+TIERS = ('original', 'original_s3', 'preprocessed', 'orphaned')
+
+# A local file and the receipt referencing it, if any.
+LocalFile = namedtuple('LocalFile', 'receipt_id s3_key stat')
+
+
+class StorageManager(object):
+    """
+    Per-tier accounting, LRU eviction of S3-backed originals and orphan sweeps.
+    """
+
+    def __init__(self, upload_dir, budget=None, orphan_min_age=3600):
+        """
+        :param upload_dir: directory uploads are saved to
+        :param budget: bytes of local disk uploads may use, None for unlimited
+        :param orphan_min_age: seconds before an unreferenced file may be
+            swept, so uploads that are not committed yet are left alone
+        """
+        self.upload_dir = upload_dir
+        self.budget = budget
+        self.orphan_min_age = orphan_min_age
+
+    @classmethod
+    def from_app(cls, app=None):
+        config = (app or current_app).config
+        return cls(config['UPLOAD_IMAGE_DIR'],
+                   budget=config.get('LOCAL_STORAGE_BUDGET'),
+                   orphan_min_age=config.get('ORPHAN_MIN_AGE', 3600))
+
+    def local_files(self):
+        """
+        Return {filename: os.stat_result} of every file in upload_dir.
+        """
+        if not os.path.isdir(self.upload_dir):
+            return {}
+        return {entry.name: entry.stat() for entry in os.scandir(self.upload_dir)
+                if entry.is_file()}
+
+    def local_bytes(self):
+        return sum(st.st_size for st in self.local_files().values())
+
+    def classify(self):
+        """
+        Return {tier: {filename: LocalFile}} for local files.
+        """
+        files = self.local_files()
+        tiers = OrderedDict((tier, {}) for tier in TIERS)
+        rows = db.session.query(Receipt.id, Receipt.img_filename,
+                                Receipt.preprocessed_img_filename, Receipt.s3_key).all()
+        for receipt_id, img_filename, preprocessed_img_filename, s3_key in rows:
+            if img_filename in files:
+                tier = 'original_s3' if s3_key else 'original'
+                tiers[tier][img_filename] = LocalFile(receipt_id, s3_key,
+                                                      files.pop(img_filename))
+            if preprocessed_img_filename in files:
+                tiers['preprocessed'][preprocessed_img_filename] = LocalFile(
+                    receipt_id, s3_key, files.pop(preprocessed_img_filename))
+        tiers['orphaned'] = {name: LocalFile(None, None, st) for name, st in files.items()}
+        return tiers
+
+    def usage(self):
+        """
+        Return OrderedDict of tier -> (file count, bytes).
+        """
+        return OrderedDict(
+            (tier, (len(files), sum(f.stat.st_size for f in files.values())))
+            for tier, files in self.classify().items())
+
+    def evict(self, budget=None, dry_run=False, keep=()):
+        """
+        Delete least recently used S3-backed originals until local usage is
+        within budget. Returns the evicted filenames.
+
+        A file is only evicted once its S3 copy is confirmed to be the same
+        size, and never if its name is in keep. Evicted images are re-fetched
+        by Receipt.ensure_local_img, which then evicts to make room for them.
+        """
+        budget = self.budget if budget is None else budget
+        if budget is None:
+            return []
+        used = self.local_bytes()
+        if used <= budget:
+            return []
+
+        candidates = self.classify()['original_s3']
+        evicted = []
+        for filename, (_, s3_key, st) in sorted(candidates.items(),
+                                                key=lambda c: c[1].stat.st_atime):
+            if used <= budget:
+                break
+            if filename in keep:
+                continue
+            try:
+                if s3_keysize(s3_key) != st.st_size:
+                    current_app.logger.error("S3 size mismatch, not evicting %s" % filename)
+                    continue
+            except S3FileNotFound:
+                current_app.logger.error("Not in S3, not evicting %s" % filename)
+                continue
+            if not dry_run:
+                try:
+                    os.remove(os.path.join(self.upload_dir, filename))
+                except FileNotFoundError:
+                    pass  # evicted by another process meanwhile
+                else:
+                    current_app.logger.info("Evicted local copy: %s" % filename)
+            used -= st.st_size
+            evicted.append(filename)
+        return evicted
+
+    def sweep(self, dry_run=False):
+        """
+        Delete orphaned files older than orphan_min_age. Returns their names.
+        """
+        cutoff = time.time() - self.orphan_min_age
+        swept = []
+        for filename, (_, _, st) in self.classify()['orphaned'].items():
+            if st.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                os.remove(os.path.join(self.upload_dir, filename))
+                current_app.logger.warning("Swept orphaned upload: %s" % filename)
+            swept.append(filename)
+        return swept
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Local stand-ins for AWS services and tesseract, for throttling and load tests."""
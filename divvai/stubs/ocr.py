@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""A stand-in for tesseract that returns canned receipt text.
+
+Preprocessing still runs for real; only the tesseract call is replaced, so
+load tests measure the app without needing tesseract installed.
+"""
+import time
+from contextlib import contextmanager
+
+from divvai.stubs.rekognition import SAMPLE_LINES
+
+
+@contextmanager
+def fake_tesseract(lines=SAMPLE_LINES, latency=0.0):
+    """
+    Within the block, ocr.image_to_string returns ``lines`` after sleeping
+    ``latency`` seconds, roughly what tesseract takes per page or strip.
+    """
+    from divvai import ocr
+    text = '\n'.join(lines)
+
+    def image_to_string(image, omp_thread_limit=None):
+        if latency:
+            time.sleep(latency)
+        return text
+
+    original = ocr.image_to_string
+    ocr.image_to_string = image_to_string
+    try:
+        yield
+    finally:
+        ocr.image_to_string = original
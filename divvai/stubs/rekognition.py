@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""A local Rekognition detect_text endpoint that throttles like AWS.
+
+Point the app at it with REKOGNITION_ENDPOINT_URL, e.g.
+
+    python -m divvai.stubs.rekognition --port 4599 --rate 5
+    REKOGNITION_ENDPOINT_URL=http://localhost:4599 python manage.py rekognize
+"""
+import argparse
+import json
+import time
+
+from flask import Flask, Response, request
+
+from divvai.rekognition import TokenBucket
+
+JSON_CONTENT_TYPE = 'application/x-amz-json-1.1'
+
+SAMPLE_LINES = ('WHOLE FOODS MARKET', '(202) 555-0100', 'BANANAS 1.99',
+                'MILK 3.49', 'TAX 0.38', 'TOTAL 5.86')
+
+
+def _json_response(body, status=200):
+    return Response(json.dumps(body), status=status, content_type=JSON_CONTENT_TYPE)
+
+
+def sample_detections(lines=SAMPLE_LINES):
+    """
+    Return Rekognition LINE detections for lines, stacked top to bottom.
+    """
+    height = 1.0 / (len(lines) + 1)
+    return [{
+        'DetectedText': line,
+        'Type': 'LINE',
+        'Id': i,
+        'Confidence': 99.0,
+        'Geometry': {'BoundingBox': {'Width': 0.8, 'Height': height * 0.8,
+                                     'Left': 0.1, 'Top': height * (i + 0.5)}},
+    } for i, line in enumerate(lines)]
+
+
+def create_stub_app(rate=5.0, burst=None, latency=0.0):
+    """
+    Return a Flask app answering DetectText, throttling above ``rate`` calls
+    per second (bursts of ``burst``) and sleeping ``latency`` seconds per call.
+    """
+    app = Flask(__name__)
+    bucket = TokenBucket(rate, burst)
+    app.config['STUB_STATS'] = stats = {'calls': 0, 'throttled': 0}
+
+    @app.route('/', methods=['POST'])
+    def dispatch():
+        target = request.headers.get('X-Amz-Target', '')
+        if not target.endswith('.DetectText'):
+            return _json_response({'__type': 'UnknownOperationException',
+                                   'message': 'Unsupported: %s' % target}, 400)
+        stats['calls'] += 1
+        if not bucket.try_acquire():
+            stats['throttled'] += 1
+            return _json_response({'__type': 'ThrottlingException',
+                                   'message': 'Rate exceeded'}, 400)
+        if latency:
+            time.sleep(latency)
+        return _json_response({'TextDetections': sample_detections(),
+                               'TextModelVersion': 'stub'})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local throttling Rekognition stub.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4599)
+    parser.add_argument('--rate', type=float, default=5.0, help='calls per second before throttling')
+    parser.add_argument('--burst', type=float, default=None)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per call')
+    args = parser.parse_args()
+    app = create_stub_app(args.rate, args.burst, args.latency)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,28 @@
 
 Misc. functions.
 """
+import hashlib
 import os
+import tempfile
+import time
 
-import boto3
 from flask import current_app
 
-from divvai.exceptions import ImageFileNotFound, S3FileNotFound
+from divvai.exceptions import CVStackDisabled, ImageFileNotFound, S3FileNotFound
+from divvai.extensions import cache
+
+
+def load_ocr():
+    """
+    Return the divvai.ocr module, importing OpenCV, scikit-image, tesseract
+    and boto3 on first use instead of at app startup.
+
+    Raises CVStackDisabled if the app is running in WEB_ONLY mode.
+    """
+    if current_app.config.get('WEB_ONLY'):
+        raise CVStackDisabled("Image processing is disabled on WEB_ONLY nodes.")
+    from divvai import ocr
+    return ocr
 
 
 def get_upload_file(img_filename):
@@ -39,6 +55,27 @@ def upload_file_to_s3(path, key):
     s3 = s3_client()
     bucket = current_app.config['UPLOAD_BUCKET']
     s3.upload_file(path, bucket, key)
+    cache.delete(s3_keysize_cache_key(key))
+
+
+def download_file_from_s3(key, path):
+    """
+    Download s3 key to path, writing to a temp file first so a partial
+    download never looks like a complete local copy. Each download gets its
+    own temp file, so concurrent fetches of the same key don't clobber it.
+    """
+    current_app.logger.info("Fetching S3 key=%s to %s" % (key, path))
+    s3 = s3_client()
+    bucket = current_app.config['UPLOAD_BUCKET']
+    directory, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=filename + '.', suffix='.part', dir=directory or None)
+    os.close(fd)
+    try:
+        s3.download_file(bucket, key, tmp_path)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
 
 
 def delete_s3_key(key):
@@ -49,6 +86,7 @@ def delete_s3_key(key):
     current_app.logger.warning("Deleting S3 key=%s" % key)
     bucket = current_app.config['UPLOAD_BUCKET']
     s3.Object(bucket, key).delete()
+    cache.delete(s3_keysize_cache_key(key))
 
 
 def s3_keysize(key):
@@ -64,12 +102,37 @@ def s3_keysize(key):
     raise S3FileNotFound("S3 Key %s doesn't exist." % key)
 
 
+def s3_keysize_cache_key(key):
+    return 's3_keysize/%s' % key
+
+
+def cached_s3_keysize(key):
+    """
+    Return s3_keysize(key), cached for S3_STATUS_CACHE_TIMEOUT seconds.
+
+    Missing keys are cached too. Uploads and deletes through this module
+    invalidate the entry.
+    """
+    cache_key = s3_keysize_cache_key(key)
+    size = cache.get(cache_key)
+    if size is None:
+        try:
+            size = s3_keysize(key)
+        except S3FileNotFound:
+            size = -1
+        cache.set(cache_key, size, timeout=current_app.config['S3_STATUS_CACHE_TIMEOUT'])
+    if size < 0:
+        raise S3FileNotFound("S3 Key %s doesn't exist." % key)
+    return size
+
+
 def s3_client():
     """
     Return s3 client either for localstack (if dev) or aws .
     """
+    import boto3
     if current_app.config['LOCALSTACK']:
-        localstack_host = current_app['S3_LOCALSTACK_HOST']
+        localstack_host = current_app.config['S3_LOCALSTACK_HOST']
         return boto3.client('s3', endpoint_url=localstack_host, use_ssl=False)
     return boto3.client('s3')
 
@@ -78,15 +141,40 @@ def s3_resource():
     """
     Return s3 resource either for localstack (if dev) or aws .
     """
+    import boto3
     if current_app.config['LOCALSTACK']:
-        localstack_host = current_app['S3_LOCALSTACK_HOST']
+        localstack_host = current_app.config['S3_LOCALSTACK_HOST']
         return boto3.resource('s3', endpoint_url=localstack_host, use_ssl=False)
     return boto3.resource('s3')
 
 
+def touch_access_time(path):
+    """
+    Set the access time of path to now, keeping its modification time.
+
+    Storage eviction is LRU by access time, which relatime/noatime mounts
+    don't keep up to date on their own.
+    """
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
 def readable_filesize(num, suffix='B'):
     for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
         if abs(num) < 1024.0:
             return "%3.1f%s%s" % (num, unit, suffix)
         num /= 1024.0
     return "%.1f%s%s" % (num, 'Y', suffix)
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """
+    Return the hex sha1 of a file's contents.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Resolve OCR output to vendors through an in-memory phone and trigram index."""
+import threading
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from divvai import process
+from divvai.db_events import on_commit, pending
+from divvai.vendors.models import Vendor
+
+
+class VendorIndex(object):
+    """
+    In-memory index of vendors by normalized phone number and name trigrams.
+
+    The index is built from the db on first use and then kept up to date
+    incrementally by the Vendor mapper events below, so resolving a receipt
+    never queries the db.
+
+    Each process has its own index and only sees its own commits right away.
+    Vendors committed by other processes (other web workers, manage.py) are
+    picked up when the index is rebuilt, at most max_age seconds after the
+    last build.
+    """
+
+    def __init__(self, min_similarity=0.5, header_lines=6, max_age=300):
+        """
+        :param min_similarity: minimum trigram Jaccard similarity of a name match
+        :param header_lines: number of lines at the top of a receipt to match
+            against vendor names
+        :param max_age: seconds before the index is rebuilt from the db, None
+            to never rebuild it
+        """
+        self.min_similarity = min_similarity
+        self.header_lines = header_lines
+        self.max_age = max_age
+        self.loaded = False
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._clear()
+
+    def __len__(self):
+        return len(self._grams_by_vendor)
+
+    def _clear(self):
+        self._phones = {}
+        self._phone_by_vendor = {}
+        self._grams_by_vendor = {}
+        self._vendors_by_gram = defaultdict(set)
+
+    def load(self):
+        """
+        (Re)build the index from every vendor in the db.
+        """
+        rows = Vendor.query.with_entities(Vendor.id, Vendor.name, Vendor.phone_num).all()
+        with self._lock:
+            self._clear()
+            for vendor_id, name, phone_num in rows:
+                self.add(vendor_id, name, phone_num)
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if not self.loaded or (self.max_age is not None
+                               and time.monotonic() - self.loaded_at > self.max_age):
+            self.load()
+
+    def add(self, vendor_id, name, phone_num):
+        """
+        Add or replace a vendor.
+        """
+        with self._lock:
+            self.remove(vendor_id)
+            phone = process.normalize_phone(phone_num)
+            if phone:
+                self._phones[phone] = vendor_id
+                self._phone_by_vendor[vendor_id] = phone
+            grams = process.trigrams(name or '')
+            self._grams_by_vendor[vendor_id] = grams
+            for gram in grams:
+                self._vendors_by_gram[gram].add(vendor_id)
+
+    def remove(self, vendor_id):
+        with self._lock:
+            for gram in self._grams_by_vendor.pop(vendor_id, ()):
+                self._vendors_by_gram[gram].discard(vendor_id)
+            phone = self._phone_by_vendor.pop(vendor_id, None)
+            if phone is not None:
+                self._phones.pop(phone, None)
+
+    def match_phone(self, text):
+        """
+        Return the id of the vendor with a phone number found in text.
+        """
+        for candidate in process.get_phones(text):
+            vendor_id = self._phones.get(process.normalize_phone(candidate))
+            if vendor_id is not None:
+                return vendor_id
+
+    def match_name(self, lines):
+        """
+        Return (vendor id, similarity) of the vendor name most similar to any line.
+        """
+        best_id, best_score = None, 0.0
+        for line in lines:
+            grams = process.trigrams(line)
+            if not grams:
+                continue
+            # Count shared trigrams per vendor from the posting lists.
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._vendors_by_gram.get(gram, ()))
+            for vendor_id, overlap in shared.items():
+                union = len(grams) + len(self._grams_by_vendor[vendor_id]) - overlap
+                score = overlap / float(union)
+                if score > best_score:
+                    best_id, best_score = vendor_id, score
+        return best_id, best_score
+
+    def resolve(self, text):
+        """
+        Return the vendor id for receipt text, by phone number then by name.
+        """
+        if not text:
+            return None
+        self.ensure_loaded()
+        with self._lock:
+            vendor_id = self.match_phone(text)
+            if vendor_id is not None:
+                return vendor_id
+            header = [line for line in text.splitlines() if line.strip()][:self.header_lines]
+            vendor_id, score = self.match_name(header)
+            if score >= self.min_similarity:
+                return vendor_id
+
+
+vendor_index = VendorIndex()
+
+
+def _pending(vendor):
+    return pending(object_session(vendor), 'vendor_index_changes')
+
+
+@event.listens_for(Vendor, 'after_insert')
+@event.listens_for(Vendor, 'after_update')
+def _index_vendor(mapper, connection, vendor):
+    _pending(vendor)[vendor.id] = (vendor.name, vendor.phone_num)
+
+
+@event.listens_for(Vendor, 'after_delete')
+def _unindex_vendor(mapper, connection, vendor):
+    _pending(vendor)[vendor.id] = None
+
+
+@on_commit('vendor_index_changes')
+def _apply_vendor_changes(changes):
+    if not vendor_index.loaded:
+        return
+    for vendor_id, fields in changes.items():
+        if fields is None:
+            vendor_index.remove(vendor_id)
+        else:
+            vendor_index.add(vendor_id, *fields)
@@ -1,7 +1,10 @@
+import json
+
 from flask import url_for
 from flask_script import Manager
 from flask_migrate import MigrateCommand
 
+from divvai import process
 from divvai.app import create_app
 
 
@@ -30,5 +33,268 @@ def list_routes():
         print(line)
 
 
+@manager.command
+def resolve_vendors(all_receipts=False):
+    """
+    Resolve vendors for processed receipts without one (or all with --all_receipts).
+    """
+    from divvai.database import db
+    from divvai.receipts.models import Receipt
+    from divvai.vendors.resolver import vendor_index
+
+    vendor_index.load()
+    query = Receipt.query.filter(Receipt.raw_text.isnot(None))
+    if not all_receipts:
+        query = query.filter(Receipt.vendor_id.is_(None))
+    resolved = 0
+    for receipt in query.yield_per(500):
+        vendor_id = vendor_index.resolve(process.receipt_text(receipt.raw_text))
+        if vendor_id is not None:
+            receipt.vendor_id = vendor_id
+            resolved += 1
+    db.session.commit()
+    print("Resolved vendors for %s receipts." % resolved)
+
+
+@manager.command
+def hash_images(batch_size=100):
+    """
+    Set img_hash for receipts uploaded before it was recorded, fetching
+    evicted images from S3. A receipt that fails is logged and skipped;
+    hashes are committed every batch_size.
+    """
+    from divvai.database import db
+    from divvai.receipts.models import Receipt
+
+    ids = [receipt_id for receipt_id, in
+           db.session.query(Receipt.id).filter(Receipt.img_hash.is_(None)).order_by(Receipt.id)]
+    hashed = failed = 0
+    for receipt_id in ids:
+        try:
+            Receipt.query.get(receipt_id).set_img_hash()
+        except Exception as e:
+            failed += 1
+            app.logger.error("Hashing failed for receipt %s: %s" % (receipt_id, e))
+            continue
+        hashed += 1
+        if hashed % int(batch_size) == 0:
+            db.session.commit()
+    db.session.commit()
+    print("Hashed %s receipt images, %s failed." % (hashed, failed))
+
+
+@manager.command
+def reindex_search(all_receipts=False, batch_size=500):
+    """
+    Fill in search columns of receipts without them (or all with --all_receipts).
+    """
+    from divvai.receipts.search import reindex_receipts
+
+    count = reindex_receipts(all_receipts=all_receipts, batch_size=int(batch_size))
+    print("Reindexed %s receipts." % count)
+
+
+@manager.command
+def storage_usage():
+    """
+    Print local upload disk usage per storage tier.
+    """
+    from divvai.storage import StorageManager
+    from divvai.utils import readable_filesize
+
+    for tier, (count, size) in StorageManager.from_app().usage().items():
+        print("{:15s} {:8d} files {:>10s}".format(tier, count, readable_filesize(size)))
+
+
+@manager.command
+def evict_uploads(budget=None, dry_run=False):
+    """
+    Evict least recently used S3-backed originals down to budget bytes
+    (default LOCAL_STORAGE_BUDGET). Run periodically, e.g. from cron; only
+    re-fetching an evicted image evicts inline, new uploads don't.
+    """
+    from divvai.storage import StorageManager
+
+    evicted = StorageManager.from_app().evict(
+        budget=int(budget) if budget is not None else None, dry_run=dry_run)
+    print("%s %s local originals." % ('Would evict' if dry_run else 'Evicted', len(evicted)))
+
+
+@manager.command
+def sweep_uploads(dry_run=False):
+    """
+    Delete uploads no receipt references, e.g. replaced preprocessed images.
+    """
+    from divvai.storage import StorageManager
+
+    swept = StorageManager.from_app().sweep(dry_run=dry_run)
+    for filename in swept:
+        print(filename)
+    print("%s %s orphaned uploads." % ('Would sweep' if dry_run else 'Swept', len(swept)))
+
+
+@manager.command
+def score_quality(rescore=False, workers=None, chunk_size=100):
+    """
+    Score receipt images with the OCR quality gate (all with --rescore).
+
+    Images are fetched (if evicted) and scored in the workers. A receipt
+    that fails is logged and skipped; scores are committed every chunk_size.
+    """
+    import os
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from divvai.database import db
+    from divvai.image_loader import load_image
+    from divvai.receipts.models import Receipt
+    from divvai.utils import download_file_from_s3, get_upload_file, load_ocr, touch_access_time
+
+    ocr = load_ocr()
+    query = db.session.query(Receipt.id, Receipt.img_filename, Receipt.s3_key)
+    if not rescore:
+        query = query.filter(Receipt.quality_issues.is_(None))
+    rows = query.all()
+
+    def score(row):
+        receipt_id, img_filename, s3_key = row
+        try:
+            with app.app_context():
+                path = get_upload_file(img_filename)
+                if os.path.exists(path):
+                    touch_access_time(path)
+                elif s3_key:
+                    download_file_from_s3(s3_key, path)
+                with load_image(path) as image:
+                    return receipt_id, ocr.quality_scores(image), None
+        except Exception as e:
+            return receipt_id, None, e
+
+    start = time.time()
+    scored = failed = 0
+    # cv2 releases the GIL, so fetching, decoding and scoring scale across threads.
+    with ThreadPoolExecutor(max_workers=int(workers) if workers else None) as pool:
+        for receipt_id, scores, exc in pool.map(score, rows):
+            if exc is not None:
+                failed += 1
+                app.logger.error("Scoring failed for receipt %s: %s" % (receipt_id, exc))
+                continue
+            Receipt.query.get(receipt_id).set_quality(scores)
+            scored += 1
+            if scored % int(chunk_size) == 0:
+                db.session.commit()
+    db.session.commit()
+    elapsed = time.time() - start
+    print("Scored %s receipts in %.2fs (%.1f/s), %s failed."
+          % (scored, elapsed, scored / elapsed if elapsed else 0, failed))
+
+
+def _rekognize_receipts(receipts):
+    """
+    Get text for receipts with Rekognition, concurrently and rate limited.
+    Returns the number of receipts that failed.
+    """
+    from divvai.database import db
+    from divvai.rekognition import RekognitionDispatcher
+
+    if not receipts:
+        return 0
+    receipts = {receipt.id: receipt for receipt in receipts}
+    dispatcher = RekognitionDispatcher.from_app()
+    # Image arguments are built lazily in this thread as the dispatcher
+    # frees up slots, and a receipt whose image can't be built fails on its
+    # own; results are saved here as they finish.
+    items = ((receipt_id, receipt.rekognition_image) for receipt_id, receipt in receipts.items())
+    failed = 0
+    for receipt_id, response, exc in dispatcher.map(items):
+        if exc is not None:
+            failed += 1
+            app.logger.error("Rekognition failed for receipt %s: %s" % (receipt_id, exc))
+            continue
+        try:
+            receipt = receipts[receipt_id]
+            receipt.set_rekognition_response(response)
+            receipt.parse_line_items()
+            receipt.resolve_vendor()
+        except Exception as e:
+            db.session.rollback()
+            failed += 1
+            app.logger.exception("Saving Rekognition text failed for receipt %s: %s"
+                                 % (receipt_id, e))
+    print("Rekognition: %s receipts, %s failed, throttled %s times."
+          % (len(receipts) - failed, failed, dispatcher.throttled))
+    return failed
+
+
+@manager.command
+def rekognize(all_receipts=False):
+    """
+    Get text with Rekognition for unprocessed receipts (all with --all_receipts).
+    """
+    from divvai.receipts.models import Receipt
+
+    query = Receipt.query
+    if not all_receipts:
+        query = query.filter(Receipt.raw_text.is_(None))
+    _rekognize_receipts(query.all())
+
+
+@manager.command
+def reprocess_stale(dry_run=False, default_preprocess_type='edge_detection'):
+    """
+    Reprocess receipts whose pipeline fingerprint differs from the current one.
+
+    Receipts are reprocessed with the engine and preprocess method they were
+    processed with; never fingerprinted ones use default_preprocess_type.
+    """
+    import os
+    from collections import Counter
+
+    from divvai.database import db
+    from divvai.receipts.models import Receipt
+
+    stale = Receipt.stale_query().all()
+    groups = Counter((r.ocr_engine, r.preprocess_type) for r in stale)
+    for (engine, preprocess_type), count in sorted(groups.items(), key=str):
+        print("{:12s} {:20s} {:6d} stale".format(
+            engine or 'unknown', preprocess_type or '-', count))
+    if dry_run or not stale:
+        return
+
+    # Unfingerprinted receipts with a Rekognition JSON raw_text came from Rekognition.
+    def used_rekognition(receipt):
+        if receipt.ocr_engine:
+            return receipt.ocr_engine == 'rekognition'
+        return process.receipt_text(receipt.raw_text) != receipt.raw_text
+
+    # Receipts with neither a local nor an S3 copy of the image are skipped.
+    def has_image(receipt):
+        return bool(receipt.s3_key) or os.path.exists(receipt.img_localpath)
+
+    skipped = [r for r in stale if not has_image(r)]
+    for receipt in skipped:
+        app.logger.warning("Skipping receipt %s, image not found: %s"
+                           % (receipt.id, receipt.img_filename))
+    stale = [r for r in stale if has_image(r)]
+
+    failed = _rekognize_receipts([r for r in stale if used_rekognition(r)])
+    for receipt in stale:
+        if used_rekognition(receipt):
+            continue
+        try:
+            if receipt.ocr_engine == 'tesseract' and receipt.preprocess_type is None:
+                receipt.get_text_from_img()
+                receipt.parse_line_items()
+            else:
+                # force: keep the method it was processed with, skip the quality gate
+                receipt.process(receipt.preprocess_type or default_preprocess_type, force=True)
+        except Exception as e:
+            db.session.rollback()
+            failed += 1
+            app.logger.exception("Reprocessing receipt %s failed: %s" % (receipt.id, e))
+    print("Reprocessed %s receipts, %s skipped, %s failed."
+          % (len(stale) - failed, len(skipped), failed))
+
+
 if __name__ == "__main__":
     manager.run()
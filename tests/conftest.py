@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures: an app on an in-memory SQLite database."""
+import os
+
+# Read by divvai.settings on import, and importing divvai creates an app.
+os.environ['DATABASE_URI'] = 'sqlite://'
+
+import pytest  # noqa: E402
+
+from divvai.app import create_app  # noqa: E402
+from divvai.database import db as _db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    app = create_app('test')
+    with app.app_context():
+        _db.create_all()
+        yield app
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return _db
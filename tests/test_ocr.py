@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+
+import cv2
+import numpy as np
+import pytesseract
+
+from divvai import ocr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_tesseract_cmd(tmp_path):
+    """
+    Return a tesseract stand-in that prints the OMP_THREAD_LIMIT it ran with.
+    """
+    path = tmp_path / 'tesseract'
+    path.write_text('#!/bin/sh\ncat > /dev/null\necho "limit=${OMP_THREAD_LIMIT:-unset}"\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_image_to_string_limits_omp_threads_per_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(pytesseract.pytesseract, 'tesseract_cmd', fake_tesseract_cmd(tmp_path))
+    monkeypatch.delenv('OMP_THREAD_LIMIT', raising=False)
+    image = np.full((20, 20), 255, np.uint8)
+    assert ocr.image_to_string(image, omp_thread_limit=1).strip() == 'limit=1'
+    assert 'OMP_THREAD_LIMIT' not in os.environ
+
+
+def test_split_strips_cuts_at_blank_bands():
+    image = np.full((1000, 100), 255, np.uint8)
+    for top in range(0, 1000, 50):
+        image[top + 10:top + 40, 20:80] = 0
+    ranges = ocr.split_strips(image, strip_height=300, overlap=60)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 1000
+    blank = set(ocr.find_blank_rows(image))
+    for (_, stop), (start, _) in zip(ranges[:-1], ranges[1:]):
+        assert stop in blank and start in blank
+        assert stop - 2 * 60 <= start < stop
+
+
+def test_split_strips_cuts_between_lines_of_a_photo():
+    image = cv2.imread(os.path.join(ROOT, 'test_imgs', 'whole_foods_in_frame.jpg'))
+    image = ocr.dilate_image(ocr.get_largest_rectangle(image))
+    profile = ocr.ink_profile(image)
+    median = np.median(profile[profile >= 1])
+    ranges = ocr.split_strips(image, strip_height=1200, overlap=60)
+    assert len(ranges) > 1
+    for (_, stop), (start, _) in zip(ranges[:-1], ranges[1:]):
+        assert profile[stop] < median / 2
+        assert profile[start] < median / 2
+
+
+def test_quality_gate_predicts_edge_detection_on_samples():
+    from divvai.image_loader import load_image
+    from divvai.settings import DefaultConfig
+
+    img_dir = os.path.join(ROOT, 'test_imgs')
+    for filename in sorted(os.listdir(img_dir)):
+        with load_image(os.path.join(img_dir, filename)) as image:
+            scores = ocr.quality_scores(image)
+            try:
+                ocr.get_largest_rectangle(image.decode())
+                found = True
+            except ocr.NoDocumentOutline:
+                found = False
+        issues = ocr.quality_issues(scores, DefaultConfig.QUALITY_THRESHOLDS)
+        assert ('no document' not in issues) == found, filename
+        assert not set(issues) & set(DefaultConfig.QUALITY_SKIP_ISSUES), filename
+    # img03's largest four-sided contour is a 72x78 px patch, not the receipt.
+    with load_image(os.path.join(img_dir, 'img03.jpg')) as image:
+        assert ocr.quality_scores(image)['document_area'] == 0.0
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+from divvai.process import classify_line, parse_price, parse_receipt_text
+
+RECEIPT = """WHOLE FOODS MARKET
+(202) 555-0100
+BANANAS 0.59 F
+MILK 2% $3.49
+COUPON MILK 1.00-
+INSTANT SAVINGS -0.50
+SUBTOTAL 2.58
+SALES TAX 0.21
+TOTAL 2.79
+VISA 2.79
+CHANGE 0.00
+"""
+
+
+def test_parse_price():
+    assert parse_price('$1,99') == Decimal('1.99')
+    assert parse_price('-0.50') == Decimal('-0.50')
+
+
+def test_parse_receipt_text_items():
+    items, _ = parse_receipt_text(RECEIPT)
+    assert items == [
+        ('BANANAS', Decimal('0.59')),
+        ('MILK 2%', Decimal('3.49')),
+        ('COUPON MILK', Decimal('-1.00')),
+        ('INSTANT SAVINGS', Decimal('-0.50')),
+    ]
+
+
+def test_parse_receipt_text_totals_skip_payment_lines():
+    _, totals = parse_receipt_text(RECEIPT)
+    assert totals == {'subtotal': Decimal('2.58'), 'tax': Decimal('0.21'),
+                      'total': Decimal('2.79')}
+
+
+def test_parse_receipt_text_ignores_lines_without_prices():
+    assert parse_receipt_text('THANK YOU\n(202) 555-0100\n') == ([], {})
+
+
+def test_classify_line_matches_whole_words():
+    assert classify_line('SALES TAX') == 'tax'
+    assert classify_line('TAXI RIDE') == 'item'
+    assert classify_line('Gratuity') == 'tip'
+    assert classify_line('Sub-Total') == 'subtotal'
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from divvai.exceptions import CVStackDisabled
+from divvai.receipts.models import Receipt
+
+
+def test_save_preprocessed_img_web_only_keeps_files(app, db, tmp_path):
+    app.config['UPLOADS_DEFAULT_DEST'] = str(tmp_path)
+    app.config['WEB_ONLY'] = True
+    os.makedirs(str(tmp_path / 'images'))
+    (tmp_path / 'images' / 'old.jpg').write_bytes(b'old')
+    receipt = Receipt('r.jpg', None)
+    receipt.preprocessed_img_filename = 'old.jpg'
+    db.session.add(receipt)
+    db.session.commit()
+
+    with pytest.raises(CVStackDisabled):
+        receipt.save_preprocessed_img('threshold')
+    assert (tmp_path / 'images' / 'old.jpg').exists()
+
+
+def test_process_falls_back_to_threshold_without_outline(app, db, tmp_path):
+    from flask_uploads import configure_uploads
+
+    from divvai.extensions import images
+    from divvai.stubs.ocr import fake_tesseract
+
+    app.config['UPLOADS_DEFAULT_DEST'] = str(tmp_path)
+    configure_uploads(app, images)
+    image_dir = tmp_path / 'images'
+    os.makedirs(str(image_dir))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'test_imgs', 'img01.jpg'), 'rb') as f:
+        (image_dir / 'r.jpg').write_bytes(f.read())
+    (image_dir / 'old.jpg').write_bytes(b'old')
+    receipt = Receipt('r.jpg', None)
+    receipt.preprocessed_img_filename = 'old.jpg'
+    db.session.add(receipt)
+    db.session.commit()
+
+    with fake_tesseract():
+        assert receipt.process('edge_detection', force=True) == 'threshold'
+    assert receipt.preprocess_type == 'threshold'
+    assert receipt.preprocessed_img_filename != 'old.jpg'
+    assert (image_dir / receipt.preprocessed_img_filename).exists()
+    assert not (image_dir / 'old.jpg').exists()
+
+
+def test_process_raises_unreadable_images(app, db, tmp_path):
+    app.config['UPLOADS_DEFAULT_DEST'] = str(tmp_path)
+    os.makedirs(str(tmp_path / 'images'))
+    (tmp_path / 'images' / 'r.jpg').write_bytes(b'not an image')
+    receipt = Receipt('r.jpg', None)
+    db.session.add(receipt)
+    db.session.commit()
+
+    with pytest.raises(ValueError, match='decode'):
+        receipt.process('edge_detection', force=True)
+    assert receipt.preprocess_type is None
+
+
+def test_set_rekognition_response_web_only(app, db):
+    app.config['WEB_ONLY'] = True
+    receipt = Receipt('r.jpg', None)
+    db.session.add(receipt)
+    db.session.commit()
+
+    receipt.set_rekognition_response({'TextDetections': [], 'TextModelVersion': '3.0'})
+    assert receipt.ocr_engine == 'rekognition'
+    assert receipt.pipeline_fingerprint
+
+
+def _receipt_with_sample(app, db, tmp_path, sample='img01.jpg'):
+    app.config['UPLOADS_DEFAULT_DEST'] = str(tmp_path)
+    os.makedirs(str(tmp_path / 'images'), exist_ok=True)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'test_imgs', sample), 'rb') as f:
+        (tmp_path / 'images' / 'r.jpg').write_bytes(f.read())
+    receipt = Receipt('r.jpg', None)
+    db.session.add(receipt)
+    db.session.commit()
+    return receipt
+
+
+def test_image_callers_release_the_mapping(app, db, tmp_path):
+    receipt = _receipt_with_sample(app, db, tmp_path)
+    receipt.score_quality()
+    assert receipt._mapped_img is None
+    assert receipt.img_obj[:2] == b'\xff\xd8'
+    assert receipt._mapped_img is None
+
+
+def test_open_image_keeps_an_already_open_mapping(app, db, tmp_path):
+    receipt = _receipt_with_sample(app, db, tmp_path)
+    with receipt.open_image() as outer:
+        with receipt.open_image() as inner:
+            assert inner is outer
+        assert not outer.closed
+    assert outer.closed
+
+
+def test_empty_image_is_rejected(app, db, tmp_path):
+    app.config['UPLOADS_DEFAULT_DEST'] = str(tmp_path)
+    os.makedirs(str(tmp_path / 'images'))
+    (tmp_path / 'images' / 'r.jpg').write_bytes(b'')
+    receipt = Receipt('r.jpg', None)
+    db.session.add(receipt)
+    db.session.commit()
+
+    with pytest.raises(ValueError, match='Empty image'):
+        receipt.score_quality()
+
+
+def test_upload_rejects_empty_files(app, db, tmp_path):
+    import io
+
+    app.config.update(WTF_CSRF_ENABLED=False, UPLOADS_DEFAULT_DEST=str(tmp_path))
+    response = app.test_client().post(
+        '/receipts/upload', content_type='multipart/form-data',
+        data={'receipt_image': (io.BytesIO(b''), 'empty.jpg')})
+    assert response.status_code == 200
+    assert Receipt.query.count() == 0
+
+
+def test_rekognition_image_outside_a_request(app, db, tmp_path):
+    from divvai.exceptions import ImageFileNotFound
+
+    receipt = _receipt_with_sample(app, db, tmp_path)
+    assert receipt.rekognition_image()['Bytes'][:2] == b'\xff\xd8'
+    assert receipt._mapped_img is None
+
+    os.remove(receipt.img_localpath)
+    with pytest.raises(ImageFileNotFound):
+        receipt.rekognition_image()
+
+
+def test_detail_page_doesnt_touch_the_image(app, db, tmp_path):
+    app.config['UPLOADS_DEFAULT_DEST'] = str(tmp_path)
+    receipt = Receipt('missing.jpg', None)
+    db.session.add(receipt)
+    db.session.commit()
+    client = app.test_client()
+
+    response = client.get('/receipts/%s' % receipt.id)
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"{}-{}"'.format(receipt.id, receipt.version)
+    assert Receipt.query.get(receipt.id).img_hash is None
+
+    # A change the cache wasn't told about, e.g. one committed in another process.
+    db.session.execute(db.text('UPDATE receipts SET version = version + 1'))
+    db.session.commit()
+    response = client.get('/receipts/%s' % receipt.id)
+    assert response.headers['ETag'] == '"{}-{}"'.format(receipt.id, receipt.version)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from botocore.exceptions import ClientError
+
+from divvai.rekognition import RekognitionDispatcher
+
+
+class FakeClient(object):
+    """
+    Throttles the first ``throttles`` calls for each image, then answers.
+    """
+
+    def __init__(self, throttles=0):
+        self.throttles = throttles
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def detect_text(self, Image):
+        name = Image['Bytes']
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            calls = self.calls[name]
+        if calls <= self.throttles:
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'DetectText')
+        return {'TextDetections': [], 'Image': name}
+
+
+def dispatcher(client, **kwargs):
+    kwargs.setdefault('max_retries', 0)
+    return RekognitionDispatcher(client=client, rate=1000, max_workers=2, base_delay=0, **kwargs)
+
+
+def test_map_yields_image_build_errors_and_continues():
+    def broken():
+        raise IOError('image missing')
+
+    items = [(1, {'Bytes': 'a'}), (2, broken), (3, lambda: {'Bytes': 'c'})]
+    results = {key: (response, exc) for key, response, exc in dispatcher(FakeClient()).map(items)}
+    assert results[1][0]['Image'] == 'a'
+    assert results[2][0] is None and isinstance(results[2][1], IOError)
+    assert results[3][0]['Image'] == 'c'
+
+
+def test_map_requeues_throttled_calls():
+    client = FakeClient(throttles=2)
+    results = list(dispatcher(client, max_requeues=2).map([(1, {'Bytes': 'a'})]))
+    assert results[0][1]['Image'] == 'a'
+    assert client.calls['a'] == 3
+
+
+def test_map_yields_throttling_after_max_requeues():
+    client = FakeClient(throttles=10)
+    (key, response, exc), = dispatcher(client, max_requeues=1).map([(1, {'Bytes': 'a'})])
+    assert response is None and isinstance(exc, ClientError)
+    assert client.calls['a'] == 2
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from divvai.vendors.models import Vendor
+from divvai.vendors.resolver import vendor_index
+
+TEXT = 'WHOLE FOODS MARKET\n(202) 555-0100\nBANANAS 0.59\n'
+
+
+def test_resolve_by_phone_and_name(db):
+    vendor = Vendor(name='Whole Foods Market', phone_num='2025550100')
+    db.session.add(vendor)
+    db.session.commit()
+    vendor_index.load()
+    assert vendor_index.resolve(TEXT) == vendor.id
+    assert vendor_index.resolve('WHOLE FOODS MARKET\nMILK 3.49') == vendor.id
+    assert vendor_index.resolve('CORNER DELI\nMILK 3.49') is None
+
+
+def test_index_follows_commits_not_flushes(db):
+    vendor_index.load()
+    vendor = Vendor(name='Whole Foods Market', phone_num='2025550100')
+    db.session.add(vendor)
+    db.session.flush()
+    db.session.rollback()
+    assert vendor_index.resolve(TEXT) is None
+
+    vendor = Vendor(name='Whole Foods Market', phone_num='2025550100')
+    db.session.add(vendor)
+    db.session.commit()
+    assert vendor_index.resolve(TEXT) == vendor.id
+
+    db.session.delete(vendor)
+    db.session.commit()
+    assert vendor_index.resolve(TEXT) is None
+
+
+def test_index_is_rebuilt_after_max_age(db, monkeypatch):
+    vendor_index.load()
+    # Committed by another process: no mapper events fire here.
+    db.session.execute(Vendor.__table__.insert().values(
+        id=7, name='Whole Foods Market', phone_num='2025550100'))
+    db.session.commit()
+    assert vendor_index.resolve(TEXT) is None
+
+    monkeypatch.setattr(vendor_index, 'loaded_at', vendor_index.loaded_at - vendor_index.max_age - 1)
+    assert vendor_index.resolve(TEXT) == 7
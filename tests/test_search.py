@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from divvai.receipts.models import Receipt
+from divvai.receipts.search import reindex_receipts, search_index, search_receipts
+
+
+def add_receipt(db, text):
+    receipt = Receipt('r.jpg', None)
+    receipt.text = text
+    db.session.add(receipt)
+    db.session.commit()
+    return receipt
+
+
+def test_search_matches_terms_and_misspellings(db):
+    search_index.load()
+    receipt = add_receipt(db, 'BANANAS 0.59\nMILK 3.49')
+    add_receipt(db, 'COFFEE 2.00')
+    assert search_receipts('bananas milk') == [receipt]
+    assert search_receipts('banannas') == [receipt]
+    assert search_receipts('apples') == []
+
+
+def test_rolled_back_changes_are_not_indexed(db):
+    search_index.load()
+    receipt = add_receipt(db, 'APPLES 1.00')
+    receipt.text = 'KIWI 1.00'
+    db.session.flush()
+    db.session.rollback()
+    assert search_receipts('kiwi') == []
+    assert search_receipts('apples') == [receipt]
+
+    db.session.delete(receipt)
+    db.session.commit()
+    assert search_receipts('apples') == []
+
+
+def test_reindex_fills_in_receipts_without_search_text(db):
+    receipts = [add_receipt(db, 'BANANAS %s' % i) for i in range(3)]
+    # Receipts from before search existed.
+    db.session.execute(db.text('UPDATE receipts SET search_text = NULL'))
+    db.session.commit()
+    search_index.load()
+    assert search_receipts('bananas') == []
+
+    assert reindex_receipts(batch_size=2) == 3
+    assert sorted(search_receipts('bananas'), key=lambda r: r.id) == receipts
+    assert reindex_receipts() == 0
+
+
+def test_search_limit_is_clamped(app, db, monkeypatch):
+    from divvai.receipts import views
+
+    limits = []
+    monkeypatch.setattr(views, 'search_receipts', lambda query, limit: limits.append(limit) or [])
+    client = app.test_client()
+    for limit in (1000, -1, 20):
+        assert client.get('/receipts/search?q=bananas&limit=%s' % limit).status_code == 200
+    assert limits == [100, 1, 20]
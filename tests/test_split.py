@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+from divvai.receipts.models import LineItem, Receipt
+from divvai.receipts.split import UNASSIGNED, allocate, settle, split_receipt
+
+D = Decimal
+
+
+def test_allocate_sums_exactly():
+    shares = allocate(D('10.00'), {'a': 1, 'b': 1, 'c': 1})
+    assert list(shares.values()) == [D('3.34'), D('3.33'), D('3.33')]
+    assert sum(shares.values()) == D('10.00')
+
+
+def test_allocate_leftover_cents_go_to_largest_remainders():
+    shares = allocate(D('1.00'), {'a': 1, 'b': 2, 'c': 3})
+    # exact shares 0.1666, 0.3333, 0.5
+    assert shares == {'a': D('0.17'), 'b': D('0.33'), 'c': D('0.50')}
+
+
+def test_allocate_negative_amount():
+    shares = allocate(D('-1.00'), {'a': 1, 'b': 1, 'c': 1})
+    assert sum(shares.values()) == D('-1.00')
+    assert sorted(shares.values()) == [D('-0.34'), D('-0.33'), D('-0.33')]
+
+
+def test_allocate_zero_weights_split_evenly():
+    assert allocate(D('1.00'), {'a': 0, 'b': 0}) == {'a': D('0.50'), 'b': D('0.50')}
+
+
+def test_allocate_no_keys_or_amount():
+    assert allocate(D('5.00'), {}) == {}
+    assert allocate(None, {'a': 1}) == {'a': D('0.00')}
+
+
+def test_split_receipt_discount_reduces_share():
+    result = split_receipt([(D('3.49'), ['ann']), (D('-1.00'), ['ann']),
+                            (D('4.00'), ['bob'])], tax=D('0.65'))
+    assert result['ann']['subtotal'] == D('2.49')
+    assert result['bob']['subtotal'] == D('4.00')
+    assert result['ann']['tax'] + result['bob']['tax'] == D('0.65')
+
+
+def test_split_receipt_unassigned_items():
+    result = split_receipt([(D('1.00'), [])])
+    assert list(result) == [UNASSIGNED]
+    assert result[UNASSIGNED]['total'] == D('1.00')
+
+
+def make_receipt(db, items, tax=None, tip=None):
+    receipt = Receipt('r.jpg', None)
+    receipt.tax, receipt.tip = tax, tip
+    db.session.add(receipt)
+    for position, (description, price, participants) in enumerate(items):
+        item = LineItem(receipt=receipt, position=position, description=description, price=price)
+        db.session.add(item)
+        db.session.flush()
+        item.assign(participants)
+    db.session.commit()
+    return receipt.id
+
+
+def test_settle_across_receipts(db):
+    first = make_receipt(db, [('PIZZA', D('20.00'), ['ann', 'bob', 'cy']),
+                              ('COUPON', D('-2.00'), ['ann'])], tax=D('1.80'), tip=D('3.00'))
+    second = make_receipt(db, [('BEER', D('9.00'), ['bob'])])
+    totals = settle([first, second])
+
+    assert list(totals) == ['ann', 'bob', 'cy']
+    assert totals['ann']['subtotal'] == D('4.67')
+    assert totals['bob']['subtotal'] == D('15.67')
+    assert totals['cy']['subtotal'] == D('6.66')
+    assert sum(t['tax'] for t in totals.values()) == D('1.80')
+    assert sum(t['tip'] for t in totals.values()) == D('3.00')
+    assert sum(t['total'] for t in totals.values()) == D('31.80')
+
+
+def test_settle_unknown_receipt(db):
+    assert settle([12345]) == {}
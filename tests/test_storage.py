@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os
+
+from divvai.receipts.models import Receipt
+from divvai.storage import StorageManager
+
+
+def add_files(app, db, tmp_path, monkeypatch, names, s3_keys=True):
+    """
+    Add a receipt with a 100 byte local image for each name, least recently
+    used first, and pretend their S3 copies exist.
+    """
+    image_dir = tmp_path / 'images'
+    os.makedirs(str(image_dir), exist_ok=True)
+    app.config.update(UPLOADS_DEFAULT_DEST=str(tmp_path), UPLOAD_IMAGE_DIR=str(image_dir))
+    for atime, name in enumerate(names, 1):
+        (image_dir / name).write_bytes(b'x' * 100)
+        os.utime(str(image_dir / name), (atime, atime))
+        receipt = Receipt(name, None)
+        receipt.s3_key = name if s3_keys else None
+        db.session.add(receipt)
+    db.session.commit()
+    monkeypatch.setattr('divvai.storage.s3_keysize', lambda key: 100)
+    return image_dir
+
+
+def test_evict_least_recently_used_within_budget(app, db, tmp_path, monkeypatch):
+    image_dir = add_files(app, db, tmp_path, monkeypatch, ['c.jpg', 'a.jpg', 'b.jpg'])
+    add_files(app, db, tmp_path, monkeypatch, ['local.jpg'], s3_keys=False)
+
+    storage = StorageManager.from_app()
+    assert storage.evict(budget=400) == []
+    assert storage.evict(budget=250, dry_run=True) == ['c.jpg', 'a.jpg']
+    assert len(os.listdir(str(image_dir))) == 4
+    assert storage.evict(budget=250) == ['c.jpg', 'a.jpg']
+    assert sorted(os.listdir(str(image_dir))) == ['b.jpg', 'local.jpg']
+    # Originals only on local disk are never evicted.
+    assert storage.evict(budget=0) == ['b.jpg']
+    assert os.listdir(str(image_dir)) == ['local.jpg']
+
+
+def test_evict_skips_size_mismatches(app, db, tmp_path, monkeypatch):
+    add_files(app, db, tmp_path, monkeypatch, ['a.jpg', 'b.jpg'])
+    monkeypatch.setattr('divvai.storage.s3_keysize', lambda key: 100 if key == 'b.jpg' else 99)
+    assert StorageManager.from_app().evict(budget=100) == ['b.jpg']
+
+
+def test_refetching_an_image_evicts_others(app, db, tmp_path, monkeypatch):
+    image_dir = add_files(app, db, tmp_path, monkeypatch, ['a.jpg', 'b.jpg', 'c.jpg'])
+    os.remove(str(image_dir / 'c.jpg'))
+    monkeypatch.setattr('divvai.receipts.models.download_file_from_s3',
+                        lambda key, path: open(path, 'wb').write(b'x' * 100))
+    app.config['LOCAL_STORAGE_BUDGET'] = 50
+
+    receipt = Receipt.query.filter_by(img_filename='c.jpg').one()
+    assert receipt.ensure_local_img() == str(image_dir / 'c.jpg')
+    # The re-fetched image is kept even though it alone is over budget.
+    assert os.listdir(str(image_dir)) == ['c.jpg']